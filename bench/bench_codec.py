@@ -0,0 +1,81 @@
+"""
+Benchmark: record codecs (json, msgpack, msgpack+zstd) by encoded size and decode throughput.
+
+Usage:
+    python3 bench/bench_codec.py [num_records]
+    REDIS_IP=localhost python3 bench/bench_codec.py [num_records] --redis
+
+With --redis, each codec is also loaded with both record layouts into redis db BENCH_DB
+(default 15, flushed between runs) and the memory redis reports for it is printed.
+"""
+import os
+import sys
+import time
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import codec  # noqa: E402
+import dataset  # noqa: E402
+from bench_ingest import make_records  # noqa: E402
+
+REDIS_IP = os.environ.get('REDIS_IP', 'localhost')
+BENCH_DB = int(os.environ.get('BENCH_DB', 15))
+
+CODECS = ['json', 'msgpack', 'msgpack+zstd']
+
+
+def measure(name, records):
+    """Return (bytes per record, decoded records per second) for one codec."""
+    dictionary = codec.train_dictionary(records[:dataset.INGEST_BATCH_SIZE]) if name == 'msgpack+zstd' else None
+    record_codec = codec.get_codec(name, dictionary)
+    encoded = [record_codec.encode(item) for item in records]
+    size = sum(len(raw) for raw in encoded) / len(encoded)
+    start = time.perf_counter()
+    for raw in encoded:
+        record_codec.decode(raw)
+    return size, len(encoded) / (time.perf_counter() - start)
+
+
+def redis_memory(client, name, layout, records):
+    """Load `records` into a fresh namespace with the given codec and layout; return used_memory growth."""
+    client.flushdb()
+    dataset._meta_cache.clear()
+    dataset.RECORD_CODEC, dataset.RECORD_LAYOUT = name, layout
+    before = client.info('memory')['used_memory']
+    dataset.load_records(records, dataset.new_namespace())
+    return client.info('memory')['used_memory'] - before
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    num_records = int(args[0]) if args else 20000
+    records = make_records(num_records)
+
+    baseline = None
+    for name in CODECS:
+        try:
+            size, rate = measure(name, records)
+        except ValueError as e:
+            print(f"{name:<13}: skipped ({e})")
+            continue
+        baseline = baseline or (size, rate)
+        print(f"{name:<13}: {size:7.1f} bytes/record ({size / baseline[0]:.2f}x json), "
+              f"decode {rate:>10,.0f} records/s ({rate / baseline[1]:.2f}x json)")
+
+    if '--redis' in sys.argv:
+        client = redis.Redis(host=REDIS_IP, port=6379, db=BENCH_DB)
+        dataset.rd = client
+        for name in CODECS:
+            for layout in ('keys', 'buckets'):
+                try:
+                    used = redis_memory(client, name, layout, records)
+                except ValueError as e:
+                    print(f"{name:<13} {layout:<7}: skipped ({e})")
+                    continue
+                print(f"{name:<13} {layout:<7}: {used / num_records:7.1f} bytes/record in redis (incl. indexes)")
+        client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: per-record SET loop (the original POST /data) vs. pipelined batch ingest.
+
+Usage:
+    REDIS_IP=localhost python3 bench/bench_ingest.py [num_records] [batch_size ...]
+
+Writes to redis db BENCH_DB (default 15) and flushes it between runs, so it never
+touches the application's dataset in db 0. The batched runs load a namespace created like
+POST /data creates one, so they include the codec, value, order, counter and rollup index
+writes that the per-record loop does not do.
+"""
+import os
+import sys
+import json
+import time
+import random
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dataset  # noqa: E402
+
+REDIS_IP = os.environ.get('REDIS_IP', 'localhost')
+BENCH_DB = int(os.environ.get('BENCH_DB', 15))
+
+CRIME_TYPES = ['THEFT', 'BURGLARY OF VEHICLE', 'FAMILY DISTURBANCE', 'CRIMINAL MISCHIEF',
+               'ASSAULT W/INJURY-FAM/DATE VIOL', 'BURGLARY OF RESIDENCE', 'HARASSMENT']
+LOCATION_TYPES = ['RESIDENCE / HOME', 'STREETS / HWY / ROAD / ALLEY', 'PARKING LOTS / GARAGE']
+
+
+def make_records(n):
+    """Build `n` synthetic records shaped like the Austin crime dataset."""
+    records = []
+    for i in range(n):
+        records.append({'incident_report_number': str(20030000000 + i),
+                        'crime_type': random.choice(CRIME_TYPES),
+                        'location_type': random.choice(LOCATION_TYPES),
+                        'occ_date': f"20{random.randint(3, 23):02d}-{random.randint(1, 12):02d}-01T00:00:00.000",
+                        'occ_time': str(random.randint(0, 2359)),
+                        'district': random.choice('ABCDEFGHI'),
+                        'latitude': str(30.2 + random.random() / 10),
+                        'longitude': str(-97.7 - random.random() / 10)})
+    return records
+
+
+def loop_ingest(client, records):
+    """The original POST /data loop: one SET round trip per record."""
+    my_id = 0
+    for item in records:
+        client.set(str(my_id), json.dumps(item))
+        my_id += 1
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_sizes = [int(arg) for arg in sys.argv[2:]] or [100, 1000, 5000]
+
+    client = redis.Redis(host=REDIS_IP, port=6379, db=BENCH_DB)
+    dataset.rd = client
+    records = make_records(num_records)
+
+    client.flushdb()
+    start = time.perf_counter()
+    loop_ingest(client, records)
+    baseline = time.perf_counter() - start
+    print(f"loop      : {num_records} rows in {baseline:.3f}s ({num_records / baseline:,.0f} rows/s)")
+
+    for batch_size in batch_sizes:
+        client.flushdb()
+        dataset._meta_cache.clear()
+        # a namespace made like POST /data makes one, so every index and counter is maintained
+        stats = dataset.load_records(records, dataset.new_namespace(), batch_size)
+        print(f"batch {batch_size:<5}: {stats['rows']} rows in {stats['seconds']:.3f}s "
+              f"({stats['rows_per_second']:,.0f} rows/s, {stats['batches']} batches, "
+              f"{baseline / max(stats['seconds'], 1e-9):.1f}x)")
+    client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: jobs per second of the worker pool as the number of worker processes grows.
+
+Usage:
+    REDIS_IP=localhost python3 bench/bench_worker.py [num_jobs] [processes ...]
+
+Submits `num_jobs` histogram jobs (JOB_TYPE=line for the time-series plot) through the
+application's queue for each pool size, waits until all of them are completed and deletes
+them again, with their images. Deduplication is off so every job is rendered, and submissions
+wait whenever the queue is at JOB_MAX_QUEUE_DEPTH. The dataset must already be loaded
+(POST /data), and no other worker should be consuming the queue while it runs.
+"""
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import worker  # noqa: E402
+import jobs  # noqa: E402
+import results  # noqa: E402
+from jobs import add_jobs, get_job_by_id, QueueFull  # noqa: E402
+
+JOB_TYPE = os.environ.get('JOB_TYPE', 'histogram')
+PARAM = os.environ.get('PARAM', 'crime_type')
+
+
+def submit(num_jobs):
+    """Submit `num_jobs` identical jobs, waiting for room whenever the queue is full."""
+    jids = []
+    batch = max(1, min(100, jobs.JOB_MAX_QUEUE_DEPTH or 100))
+    while len(jids) < num_jobs:
+        try:
+            jids += [job_dict['id'] for job_dict in
+                     add_jobs([(JOB_TYPE, {'param': PARAM}, None)] * min(batch, num_jobs - len(jids)))]
+        except QueueFull:
+            time.sleep(0.05)
+    return jids
+
+
+def run(num_jobs, num_processes):
+    """Process `num_jobs` jobs with `num_processes` workers; return the elapsed seconds."""
+    stop = multiprocessing.Event()
+    processes = worker.start_workers(num_processes, stop)
+    start = time.perf_counter()
+    jids = submit(num_jobs)
+    pending = set(jids)
+    while pending:
+        pending = {jid for jid in pending if get_job_by_id(jid)['status'] not in ('completed', 'failed')}
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for process in processes:
+        process.join()
+    # the records and index entries first, so dropping the images does not mark them expired
+    jobs._forget_jobs(jids)
+    results._forget(jids, 'bench_cleanups')
+    return elapsed
+
+
+def main():
+    # identical jobs would otherwise share a single render
+    jobs.JOB_DEDUP = False
+    num_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    counts = [int(arg) for arg in sys.argv[2:]] or sorted({1, 2, 4, worker.available_cpus()})
+
+    baseline = None
+    for num_processes in counts:
+        elapsed = run(num_jobs, num_processes)
+        rate = num_jobs / elapsed
+        baseline = baseline or rate
+        print(f"{num_processes:>3} processes: {num_jobs} jobs in {elapsed:.2f}s "
+              f"({rate:.1f} jobs/s, {rate / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,22 @@
 import os
 import requests
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 import redis
 import json
 from typing import Union, List, Dict
-from jobs import add_job, get_job_by_id, rd, return_all_jobids
+from jobs import (add_job, add_jobs, get_job_by_id, rd, result_job_id, list_jobs, job_counts, watch_job,
+                  queue_stats, QueueFull, STATUSES, JOB_TYPES, JOB_LANES)
+from results import result_size, iter_result, mark_expired, results_stats, RESULT_TTL_SECONDS
+from ingest import ingest
+from dataset import (snapshot, snapshot_stats, deactivate, reclaim_retired, find_records,
+                     order_records, value_counts, timeseries, iter_record_batches,
+                     list_records, namespace_exists, active_namespace, check_settings, TIMESERIES_BUCKETS)
+from upstream import upstream_stats
+from cache import cached_response, response_cache_stats
+from pagination import encode_cursor, decode_cursor, CursorError, CursorExpired, DEFAULT_PAGE_SIZE
 import logging
 from datetime import datetime
+from urllib.parse import urlencode
 
 
 # Read the value of the LOG_LEVEL environment variable
@@ -23,6 +33,14 @@ res = redis.Redis(host=REDIS_IP, port = 6379, db = 3)
 
 url = "https://data.austintexas.gov/resource/fdj4-gpfu.json"
 
+# Longest a client may block in /jobs/<jobid>/wait, and follow /jobs/<jobid>/events
+JOB_WAIT_MAX_SECONDS = float(os.environ.get('JOB_WAIT_MAX_SECONDS', 60))
+JOB_EVENTS_MAX_SECONDS = float(os.environ.get('JOB_EVENTS_MAX_SECONDS', 600))
+# Seconds between keep-alive comments on an idle event stream
+JOB_EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('JOB_EVENTS_HEARTBEAT_SECONDS', 15))
+# Most jobs accepted by one POST /jobs/batch
+JOB_BATCH_MAX = int(os.environ.get('JOB_BATCH_MAX', 500))
+
 
 @app.route('/', methods=['GET'])
 def hello_world() -> str:
@@ -35,6 +53,80 @@ def hello_world() -> str:
     return 'Hello, world!\n'
 
 
+def _read_cursor(kind, query, position):
+    """
+    Decode the request's ?cursor= argument for the listing `kind` of `query`.
+
+    Args:
+        position (dict): Types of the position fields the listing reads (see decode_cursor).
+
+    Returns:
+        dict: The cursor's position, or None when the request has no cursor.
+
+    Raises:
+        CursorError: The cursor is malformed, belongs to another listing or lacks its position.
+        CursorExpired: The dataset version the cursor points into has been reclaimed.
+    """
+    token = request.args.get('cursor')
+    if token is None:
+        return None
+    state = decode_cursor(token, kind, query, {'ns': str, **position})
+    if not namespace_exists(state['ns']):
+        raise CursorExpired("The dataset was reloaded since this cursor was issued; start over without it")
+    return state
+
+
+def _next_link(token):
+    """Return the url of the next page: the current request with its offset replaced by `token`."""
+    if token is None:
+        return None
+    args = request.args.to_dict()
+    args.pop('offset', None)
+    args['cursor'] = token
+    return f"{request.base_url}?{urlencode(args)}"
+
+
+@app.errorhandler(CursorError)
+def cursor_error(e):
+    """Invalid cursors are a client error; cursors into a reclaimed dataset version are gone."""
+    return {'message': str(e)}, 410 if isinstance(e, CursorExpired) else 400
+
+
+@app.errorhandler(QueueFull)
+def queue_full(e):
+    """A saturated job queue refuses submissions until the workers catch up."""
+    return {'message': str(e)}, 429, {'Retry-After': str(e.retry_after)}
+
+
+def _ndjson_lines(batches):
+    """
+    Encode batches of records as newline-delimited JSON, one chunk per batch.
+
+    If the dataset is reclaimed mid-stream the error propagates and the connection is dropped,
+    so a client never mistakes a truncated stream for the whole dataset.
+    """
+    for batch in batches:
+        if batch:
+            yield ''.join(json.dumps(item) + '\n' for item in batch)
+
+
+def _json_array_chunks(batches):
+    """
+    Encode batches of records as one JSON array, sent chunk by chunk.
+
+    The closing ']' is only sent once every batch was read; if the dataset is reclaimed
+    mid-stream the array is left unterminated and the connection is dropped.
+    """
+    yield '['
+    first = True
+    for batch in batches:
+        if batch:
+            chunk = ','.join(json.dumps(item) for item in batch)
+            yield chunk if first else ',' + chunk
+            first = False
+    yield ']\n'
+
+
 @app.route('/data', methods=['GET', 'POST', 'DELETE'])
 def handle_data() -> Union[str, List[Dict[str, str]]]:
     """
@@ -44,32 +136,54 @@ def handle_data() -> Union[str, List[Dict[str, str]]]:
         Union[str, List[Dict[str, str]]]: Response message or data.
     """
     if request.method == 'POST':
-        response = requests.get(url)
-        if response.status_code == 200:
-            # Parse the JSON response
-            data = response.json()
-            my_id = 0
-            for item in data:
-                rd.set(str(my_id), json.dumps(item))
-                my_id += 1
-            return 'Data loaded\n'
-        else:
-            print("Failed to fetch data:", response.status_code)
+        batch_size = request.args.get('batch_size', None, type=int)
+        page_size = request.args.get('page_size', None, type=int)
+        incremental = request.args.get('mode', 'full') == 'incremental'
+        if batch_size is not None and batch_size < 1:
+            return {'message': "batch_size must be a positive integer."}, 400
+        if page_size is not None and page_size < 1:
+            return {'message': "page_size must be a positive integer."}, 400
+        try:
+            stats = ingest(url, page_size, batch_size, incremental)
+        except requests.RequestException as e:
+            logging.error(f"Failed to fetch data: {e}")
+            return {'message': f"Failed to fetch data: {e}"}, 502
+        except ValueError as e:
+            # e.g. a RECORD_CODEC whose package is not installed, or a malformed upstream page
+            logging.error(f"Failed to load data: {e}")
+            return {'message': f"Failed to load data: {e}"}, 500
+        return {'message': 'Data loaded',
+                **stats}
     elif request.method == 'GET':
-        return_value = []
-        for item in rd.keys():
-            return_value.append(json.loads(rd.get(item)))
-        return return_value
+        # paged listing: each page resumes right after the last id of the previous one
+        if 'limit' in request.args or 'cursor' in request.args:
+            state = _read_cursor('data', '', {'after': str})
+            limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+            if limit < 1:
+                return {'message': "limit must be a positive integer."}, 400
+            page = list_records(state['after'] if state else None, limit, state['ns'] if state else None)
+            token = None
+            # an empty page has no last id to resume after
+            if page['more'] and page['last_id'] is not None:
+                token = encode_cursor('data', '', ns=page['namespace'], after=page['last_id'])
+            return {'data': page['records'],
+                    'total': page['total'],
+                    'cursor': token,
+                    'next': _next_link(token)}
+        # stream the dataset as redis is scanned instead of building it in memory
+        if request.args.get('format') == 'ndjson':
+            return Response(_ndjson_lines(iter_record_batches()), mimetype='application/x-ndjson')
+        return Response(_json_array_chunks(iter_record_batches()), mimetype='application/json')
     elif request.method == 'DELETE':
-        # Delete everything in redis
-        for item in rd.keys():
-            rd.delete(item)
+        # Unload the dataset in one step; its keys are reclaimed in the background
+        deactivate()
         return 'Data deleted\n'
     else:
         return 'Not possible\n'
 
 
 @app.route('/all_values_for/<param>', methods=['GET'])
+@cached_response
 def all_values_for(param):
     """
     Endpoint to get all possible values for a specific parameter and their occurrences.
@@ -80,37 +194,40 @@ def all_values_for(param):
     Returns:
         Dict[str, Union[str, Dict[str, int]]]: A dictionary containing a message and a dictionary of values with their occurrences.
     """
-    response = requests.get(url)
     dict_of_values = {}
     num_instances = 0
     message = None
-    data = []
-    for item in rd.keys():
-        data.append(json.loads(rd.get(item)))
 
-    for item in data:
-       if param in list(item.keys()):
-                num_instances +=1
+    # counted fields are read from the counters kept up to date at ingest time
+    counted = value_counts(param)
+    if counted is not None:
+        num_instances = counted['present']
+        total = counted['total']
+        dict_of_values = counted['counts']
+    else:
+        data = snapshot()
+        total = len(data)
+        for item in data:
+            if param in item:
+                num_instances += 1
                 value = item[param]
-                if isinstance(value, str) and not isinstance(value, dict):
-                    if value not in dict_of_values:
-                        dict_of_values[value] = 1
-                    else:
-                        dict_of_values[value] += 1
+                if isinstance(value, str):
+                    dict_of_values[value] = dict_of_values.get(value, 0) + 1
     
     if num_instances == 0:
         message = "This field isn't present in the data"
-    elif num_instances == len(data):
+    elif num_instances == total:
         message = "This field was present in all datapoints"
-    elif num_instances <= len(data):
+    elif num_instances <= total:
         num_instances = str(num_instances)
-        total_instances = str(len(data))
+        total_instances = str(total)
         message = f"Out of a total of {total_instances} datapoints, {num_instances} contained the {param} field" 
     return {"message": message,
             "all values": dict_of_values}
 
 # for categorical parameter
 @app.route('/all_data_for/<param>/<value>', methods=['GET'])
+@cached_response
 def all_data_for(param, value):
     """
     Endpoint to retrieve all data where a specific parameter equals a certain value.
@@ -124,40 +241,67 @@ def all_data_for(param, value):
     """    
     limit = request.args.get('limit', None, type=int)
     offset = request.args.get('offset', 0, type=int)
-    list_of_data = []
-    num_instances = 0
+    if (limit is not None and limit < 1) or offset < 0:
+        return {'message': "limit must be a positive integer and offset a non-negative one."}, 400
     message = None
-    data = []
-    
-    for item in rd.keys():
-        data.append(json.loads(rd.get(item)))
-
-    for item in data:
-        if param in item.keys():
-            if item[param] == value:
-                num_instances += 1
-                list_of_data.append(item)
+    token = None
+    query = f"{param}={value}"
+
+    # a cursor resumes the listing in the dataset version it was issued for
+    state = _read_cursor('all_data_for', query, {'after': (str, type(None)), 'offset': (int, type(None))})
+    if state is not None:
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        offset = state.get('offset') or 0
+    # as before, offset only applies together with limit
+    if limit is None:
+        offset = 0
+
+    # indexed fields only read the matching page; others scan the snapshot
+    found = find_records(param, value, offset, limit,
+                         after=state.get('after') if state else None,
+                         namespace=state['ns'] if state else None)
+    if found is not None:
+        num_instances = found['matched']
+        total = found['total']
+        list_of_data = found['records']
+        if found['more']:
+            token = encode_cursor('all_data_for', query, ns=found['namespace'], after=found['last_id'])
+    else:
+        namespace = active_namespace()
+        if state is not None and state['ns'] != namespace:
+            raise CursorExpired("The dataset was reloaded since this cursor was issued; start over without it")
+        data = snapshot()
+        total = len(data)
+        list_of_data = [item for item in data if item.get(param) == value]
+        num_instances = len(list_of_data)
+        if limit is not None:
+            list_of_data = list_of_data[offset:offset+limit]
+            # an empty page never leads to another one
+            if list_of_data and offset + limit < num_instances:
+                token = encode_cursor('all_data_for', query, ns=namespace, offset=offset + limit)
     
     # Message formulation
     if num_instances == 0:
         message = "This field isn't present in the data"
-    elif num_instances == len(data):
+    elif num_instances == total:
         message = "This field was present in all datapoints"
-    elif num_instances <= len(data):
+    elif num_instances <= total:
         num_instances = str(num_instances)
-        total_instances = str(len(data))
+        total_instances = str(total)
         message = f"Out of a total of {total_instances} datapoints, {num_instances} contained the {value} value of the {param} field"
-    
-    if limit is not None:
-        list_of_data = list_of_data[offset:offset+limit]
 
-    return {"message": message,
-            "all data": list_of_data}
+    result = {"message": message,
+              "all data": list_of_data}
+    if limit is not None:
+        result['cursor'] = token
+        result['next'] = _next_link(token)
+    return result
 
 # for sequential parameters, like date (will also work for id?)
 
 # organize from date lowest to highest
 @app.route('/order/<order>/<param>', methods=['GET'])
+@cached_response
 def org_by(param, order):
     """
     This endpoint organizes the data by a quantitative variable <param>. Although designed primarily for datetime variables, this function works on other quantitative variables as well.
@@ -175,109 +319,206 @@ def org_by(param, order):
     limit = request.args.get('limit', None, type=int)
     offset = request.args.get('offset', 0, type=int)
     
-    try:
-        if order not in ["ascend", "descend"]:
-            raise ValueError("Invalid value for 'order'. Please use 'ascend' or 'descend'.")
-        else:
-            print("Valid value for 'order'.")
-    except ValueError as e:
-        print(e)
-    
+    if order not in ["ascend", "descend"]:
+        return {'message': "Invalid value for 'order'. Please use 'ascend' or 'descend'."}, 400
+    if (limit is not None and limit < 1) or offset < 0:
+        return {'message': "limit must be a positive integer and offset a non-negative one."}, 400
     
     # declaring variables
-    my_list_of_data = []
-    num_instances = 0
     message = None
-
-    data = []
-    for item in rd.keys():
-        data.append(json.loads(rd.get(item)))
-
-
-    list_of_dates = []
     starting_date = None
     ending_date = None
-    
-    # populating list_of_dates
-    for item in data:
-        if param in list(item.keys()):
-            num_instances += 1
-            list_of_dates.append(item[str(param)])
-    
-    # sorting in ascending or descending order
-    if order == 'ascend':
-        sorted_list = sorted(list_of_dates)
-    elif order == 'descend':
-        sorted_list = sorted(list_of_dates, reverse=True)
-    
-    # sorting list of data in order
-    new_list = []
-    for date in sorted_list:
-        for item in data:
-            if param in list(item.keys()):
-                if item[str(param)] == str(date):
-                    new_list.append(item)
-                    break
-    
-    # sorting list of data with limit and offset parameters in place
-    new_list = []
-    if limit is not None:
-        for date in sorted_list[offset:offset+limit]:
-            for item in data:
-                if param in list(item.keys()):
-                    if item[str(param)] == str(date):
-                        new_list.append(item)
-                        starting_date = str(sorted_list[offset])
-                        ending_date = str(sorted_list[offset+limit])
-                        break
+    token = None
+    query = f"{order}:{param}"
+
+    # a cursor resumes the listing at its rank in the dataset version it was issued for
+    state = _read_cursor('order', query, {'offset': int})
+    if state is not None:
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        offset = state['offset']
+    # as before, offset only applies together with limit
+    if limit is None:
+        offset = 0
+
+    # numeric/date fields with an ordering index only read the requested page
+    ordered = order_records(param, order == 'descend', offset, limit,
+                            namespace=state['ns'] if state else None)
+    if ordered is not None:
+        num_instances = ordered['matched']
+        total = ordered['total']
+        new_list = ordered['records']
+        if limit is not None and ordered['next_offset'] is not None:
+            token = encode_cursor('order', query, ns=ordered['namespace'], offset=ordered['next_offset'])
     else:
-        for date in sorted_list:
-            for item in data:
-                if param in list(item.keys()):
-                    if item[str(param)] == str(date):
-                        new_list.append(item)
-                        starting_date = str(sorted_list[0])
-                        ending_date = str(sorted_list[-1])
-                        break
+        namespace = active_namespace()
+        if state is not None and state['ns'] != namespace:
+            raise CursorExpired("The dataset was reloaded since this cursor was issued; start over without it")
+        data = snapshot()
+        total = len(data)
+        with_param = [item for item in data if param in item]
+        num_instances = len(with_param)
+        new_list = sorted(with_param, key=lambda item: str(item[param]), reverse=(order == 'descend'))
+        if limit is not None:
+            new_list = new_list[offset:offset+limit]
+            # an empty page never leads to another one
+            if new_list and offset + limit < num_instances:
+                token = encode_cursor('order', query, ns=namespace, offset=offset + limit)
+
+    if new_list:
+        starting_date = str(new_list[0].get(param))
+        ending_date = str(new_list[-1].get(param))
 
     # formulating message, and associated params
     if num_instances == 0:
         message = f"The field {param} isn't present in the data"
-    elif num_instances == len(data):
+    elif num_instances == total:
         message = f"The field {param} was present in all datapoints. The starting value of {param} was {starting_date} and the ending value of {param} was {ending_date}, and the data was ordered in {order}ing order."
-    elif num_instances <= len(data):
+    elif num_instances <= total:
         num_instances = str(num_instances)
-        total_instances = str(len(data))
+        total_instances = str(total)
         message = f"Out of a total of {total_instances} datapoints, {num_instances} contained the {param} field. The starting value of {param} was {starting_date} and the ending value of {param} was {ending_date}, and the data was ordered in {order}ing order."
     
     
     # returning resulting data and message
-    return {'data': new_list,
-            'message': message}
+    result = {'data': new_list,
+              'message': message}
+    if limit is not None:
+        result['cursor'] = token
+        result['next'] = _next_link(token)
+    return result
+
+
+@app.route('/aggregate/timeseries', methods=['GET'])
+@cached_response
+def aggregate_timeseries():
+    """
+    Endpoint to get the number of records per time period of the most frequent values of a field,
+    read from the rollups kept up to date at ingest time.
+
+    GET parameters:
+        field: A field in TIMESERIES_FIELDS (default crime_type).
+        bucket: year, month or day (default year).
+        top: Only this many values, those with the most records (default 5; 0 for all).
+
+    Returns:
+        Dict: 'periods' in ascending order and, per value, its 'series' of counts per period.
+    """
+    field = request.args.get('field', 'crime_type')
+    bucket = request.args.get('bucket', 'year')
+    top = request.args.get('top', 5, type=int)
+    if bucket not in TIMESERIES_BUCKETS:
+        return {'message': f"Invalid bucket. Please use one of: {', '.join(TIMESERIES_BUCKETS)}."}, 400
+    if top < 0:
+        return {'message': "top must be a non-negative integer."}, 400
+    series = timeseries(field, bucket, top or None)
+    if series is None:
+        return {'message': f"{field} has no time-series rollups (see TIMESERIES_FIELDS)."}, 400
+    return {'field': field, 'bucket': bucket, **series}
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Endpoint reporting cache statistics for this API process.
+
+    Returns:
+        Dict[str, Dict[str, Union[int, float]]]: Snapshot and response cache sizes, memory budgets
+        and hit/miss/eviction counters, upstream download/revalidation counters, and the size,
+        budget and eviction/expiry counters of the job results store, and the depth and
+        queued time of each job queue lane.
+    """
+    return {'snapshot': snapshot_stats(),
+            'responses': response_cache_stats(),
+            'upstream': upstream_stats(),
+            'results': results_stats(),
+            'queue': queue_stats()}
 
 
 @app.route('/jobs', methods = ['GET','POST'])
 def jobs_general():
     """
-    Endpoint to handle general job operations (POST for adding a job, GET for getting all job IDs).
+    Endpoint to handle general job operations (POST for adding a job, GET for listing jobs).
+
+    GET parameters (all optional):
+        status: Only jobs currently in this status.
+        since: Only jobs submitted (or, with status, moved to it) after this Unix time.
+        limit: Page size (default DEFAULT_PAGE_SIZE).
+        cursor: The 'cursor' of the previous page.
 
     Returns:
-        Union[str, Dict[str, str]]: Response message or dictionary containing job information.
+        Union[str, Dict[str, str]]: Response message or dictionary containing job information;
+        a listing also has the number of jobs in each status. An invalid job spec gets 400
+        with every validation error.
     """
     if request.method == 'POST':
-        data = request.get_json()
-        try:
-            job_type = data['job_type']
-            params = data['params']
-        except ValueError:
-            return "Parameter not supported by jobs endpoint"
-        job_dict = add_job(job_type, params)
-        return job_dict
+        data = request.get_json(silent=True)
+        errors = _job_spec_errors(data)
+        if errors:
+            return {'message': "Invalid job spec; the job was not added.", 'errors': errors}, 400
+        return add_job(data['job_type'], data['params'], lane=data.get('priority'))
     elif request.method == 'GET':
-        ret_string = return_all_jobids() + '\n'
-        return ret_string
+        status = request.args.get('status')
+        since = request.args.get('since', None, type=float)
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        if limit < 1:
+            return {'message': "limit must be a positive integer."}, 400
+        if status is not None and status not in STATUSES:
+            return {'message': f"Invalid status. Please use one of: {', '.join(STATUSES)}."}, 400
+        query = urlencode({'status': status or '', 'since': '' if since is None else since})
+        position = None
+        if 'cursor' in request.args:
+            state = decode_cursor(request.args['cursor'], 'jobs', query, {'score': (int, float), 'skip': int})
+            position = (state['score'], state['skip'])
+        page = list_jobs(status, since, limit, position)
+        token = None
+        if page['next'] is not None:
+            token = encode_cursor('jobs', query, score=page['next'][0], skip=page['next'][1])
+        return {'jobs': page['jobs'],
+                'counts': job_counts(),
+                'cursor': token,
+                'next': _next_link(token)}
     
 
+def _job_spec_errors(spec, prefix=''):
+    """Return what is wrong with a job spec (empty if it is valid), each error starting with `prefix`."""
+    if not isinstance(spec, dict):
+        return [f"{prefix}expected an object with 'job_type' and 'params'"]
+    errors = []
+    if spec.get('job_type') not in JOB_TYPES:
+        errors.append(f"{prefix}'job_type' must be one of: {', '.join(JOB_TYPES)}")
+    if not isinstance(spec.get('params'), dict):
+        errors.append(f"{prefix}'params' must be an object")
+    if spec.get('priority') is not None and spec['priority'] not in JOB_LANES:
+        errors.append(f"{prefix}'priority' must be one of: {', '.join(JOB_LANES)}")
+    return errors
+
+
+@app.route('/jobs/batch', methods = ['POST'])
+def jobs_batch():
+    """
+    Endpoint to add many jobs at once: all are validated first, then saved and queued together.
+
+    Body: a JSON array of {'job_type', 'params', optional 'priority'} objects (or {'jobs': [...]}),
+    at most JOB_BATCH_MAX.
+
+    Returns:
+        Dict: 'ids' of the new jobs and their 'jobs' information, in the order submitted;
+        400 with every validation error if any job spec is invalid, or 429 if the batch does not
+        fit in the queue (no job is added then).
+    """
+    data = request.get_json(silent=True)
+    specs = data.get('jobs') if isinstance(data, dict) else data
+    if not isinstance(specs, list) or not specs:
+        return {'message': "Expected a non-empty JSON array of jobs."}, 400
+    if len(specs) > JOB_BATCH_MAX:
+        return {'message': f"At most {JOB_BATCH_MAX} jobs per batch."}, 400
+    errors = [error for index, spec in enumerate(specs) for error in _job_spec_errors(spec, f'jobs[{index}]: ')]
+    if errors:
+        return {'message': "Invalid job specs; no job was added.", 'errors': errors}, 400
+    jobs = add_jobs([(spec['job_type'], spec['params'], spec.get('priority')) for spec in specs])
+    return {'ids': [job_dict['id'] for job_dict in jobs], 'jobs': jobs}
+
+
 @app.route('/jobs/<jobid>', methods = ['GET'])
 def get_job(jobid):
     """
@@ -289,7 +530,104 @@ def get_job(jobid):
     Returns:
         Union[str, Dict[str, str]]: Response message or dictionary containing job information.
     """
-    return get_job_by_id(jobid)
+    job_dict = get_job_by_id(jobid)
+    if job_dict is None:
+        return {'message': f"Job {jobid} not found (finished jobs expire after a while)"}, 404
+    return job_dict
+
+@app.route('/jobs/<jobid>/wait', methods = ['GET'])
+def wait_for_job(jobid):
+    """
+    Endpoint that blocks until a job is finished (completed, failed or expired) or `timeout` passes.
+
+    Args:
+        jobid (str): The ID of the job to wait for.
+        timeout: (Optional) Seconds to wait, up to JOB_WAIT_MAX_SECONDS (default 30).
+
+    Returns:
+        Dict[str, str]: The job information as of when the wait ended; check its status.
+    """
+    timeout = min(max(request.args.get('timeout', 30, type=float), 0), JOB_WAIT_MAX_SECONDS)
+    job_dict = None
+    for job_dict in watch_job(jobid, timeout):
+        if job_dict is None:
+            return {'message': f"Job {jobid} not found (finished jobs expire after a while)"}, 404
+    return job_dict
+
+def _job_event_stream(jobid, timeout):
+    """Encode the status changes of a job as server-sent events."""
+    for job_dict in watch_job(jobid, timeout, heartbeat=JOB_EVENTS_HEARTBEAT_SECONDS):
+        if job_dict is None:
+            yield ': keep-alive\n\n'
+            continue
+        yield f"event: status\ndata: {json.dumps(job_dict)}\n\n"
+
+@app.route('/jobs/<jobid>/events', methods = ['GET'])
+def job_events(jobid):
+    """
+    Endpoint streaming a job's status changes as server-sent events (text/event-stream).
+
+    The current state is sent first, then one 'status' event per change; the stream ends once
+    the job is finished or after JOB_EVENTS_MAX_SECONDS.
+
+    Args:
+        jobid (str): The ID of the job to follow.
+
+    Returns:
+        Response: The event stream, or a 404 message for an unknown job.
+    """
+    if get_job_by_id(jobid) is None:
+        return {'message': f"Job {jobid} not found (finished jobs expire after a while)"}, 404
+    response = Response(_job_event_stream(jobid, JOB_EVENTS_MAX_SECONDS), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # don't let a reverse proxy buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _image_response(jobid, as_attachment):
+    """
+    Stream the image of job `jobid` from redis, with caching headers and Range support.
+
+    A job's image never changes once rendered, so the id of the job that rendered it is a
+    strong ETag and the response may be cached as immutable.
+    """
+    # a job deduplicated onto an identical one shares that job's image
+    source = result_job_id(jobid)
+    if source is None:
+        return {'message': f"Job {jobid} not found (finished jobs expire after a while)"}, 404
+    size = result_size(source)
+    if size is None:
+        # the image outlived its TTL or was evicted to stay within the results budget
+        mark_expired(jobid)
+        status = (get_job_by_id(jobid) or {}).get('status', 'expired')
+        if status == 'expired':
+            return {'id': jobid, 'status': status, 'message': "The result of this job has expired; submit it again"}, 410
+        return {'id': jobid, 'status': status, 'message': "The result of this job is not ready yet"}, 404
+
+    response = Response(mimetype='image/png')
+    response.set_etag(source)
+    response.headers['Cache-Control'] = f'public, max-age={RESULT_TTL_SECONDS}, immutable'
+    response.headers['Accept-Ranges'] = 'bytes'
+    if as_attachment:
+        response.headers['Content-Disposition'] = f'attachment; filename={jobid}.png'
+    if request.if_none_match.contains(source):
+        response.status_code = 304
+        return response
+
+    start, stop = 0, size
+    # If-Range: only honour the range if the client's copy is this image
+    if request.range is not None and request.if_range.etag in (None, source):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        start, stop = byte_range
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    response.response = iter_result(source, start, stop)
+    response.content_length = stop - start
+    return response
 
 @app.route('/results/<jobid>', methods = ['GET'])
 def calculate_result(jobid):
@@ -300,14 +638,9 @@ def calculate_result(jobid):
         jobid (str): The ID of the job to retrieve results for.
 
     Returns:
-        Union[str, bytes]: Result of the computation or an error message.
+        Response: The resulting image (inline), or an error message.
     """
-    # return computed outcome for that jobid
-    try:
-        result = res.get(jobid)
-        return result
-    except TypeError:
-        return "Cannot find key in results database"
+    return _image_response(jobid, as_attachment=False)
 
 @app.route('/download/<jobid>', methods=['GET'])
 def download(jobid):
@@ -318,38 +651,62 @@ def download(jobid):
         jobid (str): The ID of the job whose image to download.
 
     Returns:
-        send_file: Response containing the image file.
+        Response: The resulting image as an attachment, streamed from the results db.
     """
-    path = f'/{jobid}.png'
-    with open(path, 'wb') as f:
-        f.write(res.hget(jobid, 'image'))   # 'results' is a client to the results db
-    return send_file(path, mimetype='image/png', as_attachment=True)
+    return _image_response(jobid, as_attachment=True)
 
 @app.route('/help', methods=['GET'])
 def help_route():
     ret_string = """{
     General routes:
         /data POST: Posts data to rd database
-        /data GET: Gets data from rd database
+        /data?mode=incremental POST: Fetches and upserts only the records changed since the last load
+        /data?batch_size=int&page_size=int POST: Same, fetching page_size records per upstream page
+                                                  and writing batch_size records per redis round trip
+        /data GET: Gets data from rd database (streamed as a JSON array while redis is scanned)
+        /data?format=ndjson GET: Same, as newline-delimited JSON (one record per line)
+        /data?limit=int GET: One page of records; follow 'next' (or pass 'cursor') for the following page
         /data DELETE: Deletes data from rd database
 
         /all_values_for/<param> : Gets all possible values for a specific parameter (along w/ # occurences)
         
         /all_data_for/<param>/<value> : Returns all datapoints where a specific parameter equals a certain value. Works best for 
         /all_data_for/<param>/<value>?limit=int&offset=int : Same, with limit, offset functionality
+        /all_data_for/<param>/<value>?limit=int&cursor=str : Same, resuming from the 'cursor' of the previous page
 
         /order/<order>/<param> : Organizing data in <order> 'ascend' or 'descend', for quantitative <param>
         /order/<order>/<param>?limit=int&offset=int : Same, with limit, offset functionality
+        /order/<order>/<param>?limit=int&cursor=str : Same, resuming from the 'cursor' of the previous page
         
 
+        /aggregate/timeseries?field=str&bucket=str&top=int : Records per year, month or day of the top values
+                                                              of field, from rollups kept at ingest time
+
+        /stats : Cache statistics (dataset snapshot and response cache sizes, hits, misses, evictions,
+                 upstream downloads and 304 revalidations, stored job images and evictions,
+                 depth and queued time of each job queue lane)
+
+        /all_values_for, /all_data_for and /order responses carry an ETag; send it back in
+        If-None-Match to get a 304 while the dataset is unchanged
+
     Jobs routes:
-        /jobs POST : Can post job with parameters 'job_type'(str) and 'params'(dict) 
-        /jobs : Gets list of all jobids
+        /jobs POST : Can post job with parameters 'job_type'(str), 'params'(dict) and optionally 'priority'(lane)
+                     (429 with Retry-After while the queue holds JOB_MAX_QUEUE_DEPTH jobs)
+        /jobs/batch POST : Posts a JSON array of such jobs at once; returns their ids in the same order
+        /jobs : Lists jobs, oldest first, with the number of jobs in each status
+        /jobs?status=str&since=float&limit=int&cursor=str : Same, filtered by status and submit time, paged
         /jobs/<jobid> : Gets specific info for jobid
-        /download/<jobid> : Downloads specific jobid's resulting image.
+        /jobs/<jobid>/wait?timeout=float : Waits (up to timeout seconds) for jobid to finish, then gets its info
+        /jobs/<jobid>/events : Server-sent events stream of jobid's status changes
+        /download/<jobid> : Downloads specific jobid's resulting image (410 once it has expired)
+        /results/<jobid> : Same image, shown inline; both support ETag/If-None-Match and Range requests
     }
     """
     return ret_string
 
 if __name__ == '__main__':
+    # refuse to start with record settings POST /data could not use
+    check_settings()
+    # finish reclaiming any dataset versions a previous process left behind
+    reclaim_retired()
     app.run(host = '0.0.0.0', port = 5000, debug = True)
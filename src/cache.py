@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+import functools
+import threading
+import logging
+from collections import OrderedDict
+import redis
+from flask import request, current_app
+from dataset import dataset_version
+
+# Read the value of the LOG_LEVEL environment variable
+log_level = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=log_level)
+
+REDIS_IP = os.environ.get('REDIS_IP')
+
+# Most responses and bytes of response bodies kept per API process
+RESPONSE_CACHE_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Share responses between API processes through redis (set to 1 to enable)
+RESPONSE_CACHE_SHARED = os.environ.get('RESPONSE_CACHE_SHARED', '0') == '1'
+# Seconds a shared response outlives its last write; old dataset versions are never read again
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 600))
+
+SHARED_PREFIX = 'response_cache:'
+
+rd = redis.Redis(host=REDIS_IP, port=6379, db=0)
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered responses, bounded by entry count and body bytes.
+
+    Keys embed the dataset version, so a reload never serves an old answer; entries of
+    older versions are dropped the first time a newer version is seen.
+    """
+
+    def __init__(self, max_entries, max_bytes, shared=None, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'not_modified': 0,
+                       'evictions': 0, 'invalidations': 0, 'uncacheable': 0}
+
+    def _observe_version(self, version):
+        if version != self._version:
+            if self._version is not None and version > self._version:
+                self._stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            self._version = max(version, self._version or 0)
+
+    def get(self, key, version):
+        """
+        Return the cached entry {'etag', 'body', 'mimetype'} for `key`, or None.
+
+        Args:
+            key (str): Cache key made by cache_key().
+            version (int): Dataset version the key was made for.
+        """
+        with self._lock:
+            self._observe_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry
+        if self.shared is not None:
+            try:
+                stored = self.shared.hgetall(SHARED_PREFIX + key)
+            except redis.RedisError as e:
+                logging.warning(f"Shared response cache unavailable: {e}")
+                stored = None
+            if stored:
+                entry = {'etag': stored[b'etag'].decode('utf-8'), 'body': stored[b'body'],
+                         'mimetype': stored[b'mimetype'].decode('utf-8')}
+                with self._lock:
+                    self._stats['shared_hits'] += 1
+                    self._insert(key, entry)
+                return entry
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, key, entry):
+        """Cache a rendered response locally and, when enabled, in the shared redis tier."""
+        with self._lock:
+            self._insert(key, entry)
+        if self.shared is not None:
+            try:
+                pipe = self.shared.pipeline(transaction=False)
+                pipe.hset(SHARED_PREFIX + key, mapping=entry)
+                pipe.expire(SHARED_PREFIX + key, self.ttl)
+                pipe.execute()
+            except redis.RedisError as e:
+                logging.warning(f"Shared response cache unavailable: {e}")
+
+    def _insert(self, key, entry):
+        size = len(entry['body'])
+        if size > self.max_bytes:
+            self._stats['uncacheable'] += 1
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old['body'])
+        self._entries[key] = entry
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted['body'])
+            self._stats['evictions'] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self):
+        """Return the cache's size, budget and hit/miss/eviction counters."""
+        with self._lock:
+            hits = self._stats['hits'] + self._stats['shared_hits']
+            lookups = hits + self._stats['misses']
+            return {'version': self._version,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_entries': self.max_entries,
+                    'max_bytes': self.max_bytes,
+                    'shared': self.shared is not None,
+                    'hit_ratio': round(hits / lookups, 3) if lookups else None,
+                    **self._stats}
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MAX_BYTES,
+                               shared=rd if RESPONSE_CACHE_SHARED else None)
+
+
+def cache_key(host, path, args, version):
+    """
+    Key of a response: the route, its query arguments (in any order) and the dataset version.
+
+    The host is part of the key because paged responses embed absolute 'next' links.
+    """
+    raw = json.dumps([host, path, sorted(args), version], separators=(',', ':'))
+    return f"{version}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def cached_response(view):
+    """
+    Serve a read-only route from the response cache, with a strong ETag.
+
+    Successful responses are cached per route, query arguments and dataset version; a request
+    whose If-None-Match matches gets a 304 without the route being recomputed or resent.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = dataset_version()
+        key = cache_key(request.host_url, request.path, request.args.items(multi=True), version)
+        entry = response_cache.get(key, version)
+        if entry is None:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = {'etag': hashlib.sha256(body).hexdigest(), 'body': body, 'mimetype': response.mimetype}
+            response_cache.put(key, entry)
+        response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.make_conditional(request)
+        if response.status_code == 304:
+            response_cache.count_not_modified()
+        return response
+    return wrapper
+
+
+def response_cache_stats():
+    """Return the response cache's size, budget and hit/miss/eviction counters."""
+    return response_cache.stats()
@@ -0,0 +1,101 @@
+import json
+import logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the zstd dictionary trained from the first records of a load
+ZSTD_DICT_SIZE = 16 * 1024
+# zstd refuses to train on too few samples; below this the codec compresses without a dictionary
+_MIN_TRAINING_SAMPLES = 64
+
+
+class JsonCodec:
+    """Records stored as JSON text (the original layout)."""
+
+    name = 'json'
+    trainable = False
+
+    def encode(self, item):
+        return json.dumps(item).encode('utf-8')
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+class MsgpackCodec:
+    """Records stored as msgpack, optionally zstd-compressed with a dictionary shared by the namespace."""
+
+    def __init__(self, compress=False, dictionary=None):
+        if msgpack is None:
+            raise ValueError("The msgpack record codec needs the 'msgpack' package")
+        if compress and zstandard is None:
+            raise ValueError("The msgpack+zstd record codec needs the 'zstandard' package")
+        self.name = 'msgpack+zstd' if compress else 'msgpack'
+        self.trainable = compress
+        self._compressor = None
+        self._decompressor = None
+        if compress:
+            zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self._compressor = zstandard.ZstdCompressor(level=3, dict_data=zdict)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def encode(self, item):
+        raw = msgpack.packb(item, use_bin_type=True)
+        if self._compressor is not None:
+            raw = self._compressor.compress(raw)
+        return raw
+
+    def decode(self, raw):
+        if self._decompressor is not None:
+            raw = self._decompressor.decompress(raw)
+        return msgpack.unpackb(raw, raw=False)
+
+
+def get_codec(name, dictionary=None):
+    """
+    Return the codec called `name` ('json', 'msgpack' or 'msgpack+zstd').
+
+    Args:
+        name (str): Codec name as stored in a namespace's metadata.
+        dictionary (bytes): Trained zstd dictionary, for 'msgpack+zstd'.
+
+    Raises:
+        ValueError: For an unknown codec or one whose optional package is not installed.
+    """
+    if name == 'json':
+        return JsonCodec()
+    if name == 'msgpack':
+        return MsgpackCodec()
+    if name == 'msgpack+zstd':
+        return MsgpackCodec(compress=True, dictionary=dictionary)
+    raise ValueError(f"Unknown record codec: {name}")
+
+
+def train_dictionary(records, size=ZSTD_DICT_SIZE):
+    """
+    Train a zstd dictionary on sample records, so the categorical values every record repeats
+    (crime_type, location_type, district...) are stored once per namespace instead of per record.
+
+    Args:
+        records (list): Sample records (dicts).
+        size (int): Dictionary size in bytes.
+
+    Returns:
+        bytes: The dictionary, or None when there are too few samples to train on.
+    """
+    if zstandard is None or msgpack is None or len(records) < _MIN_TRAINING_SAMPLES:
+        return None
+    samples = [msgpack.packb(item, use_bin_type=True) for item in records]
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError as e:
+        logging.warning(f"Could not train a zstd dictionary: {e}")
+        return None
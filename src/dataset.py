@@ -0,0 +1,899 @@
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from collections import Counter
+import threading
+import logging
+import redis
+from codec import get_codec, train_dictionary
+
+# Read the value of the LOG_LEVEL environment variable
+log_level = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=log_level)
+
+REDIS_IP = os.environ.get('REDIS_IP')
+
+# Number of records written per pipeline round trip during ingest
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+# Seconds a replaced dataset version stays readable before it is reclaimed
+RECLAIM_GRACE_SECONDS = float(os.environ.get('RECLAIM_GRACE_SECONDS', 30))
+# Largest estimated in-memory size of the per-process dataset snapshot
+SNAPSHOT_MAX_BYTES = int(os.environ.get('SNAPSHOT_MAX_BYTES', 512 * 1024 * 1024))
+# Fields that get a param:value -> record ids index, fixed per namespace when it is created
+INDEXED_FIELDS = [field.strip() for field in os.environ.get(
+    'INDEXED_FIELDS',
+    'crime_type,ucr_code,family_violence,location_type,zip_code,council_district,sector,'
+    'district,pra,census_tract,clearance_status,ucr_category,category_description').split(',')
+    if field.strip()]
+# Numeric and date fields that get a sorted set ordering their records, fixed per namespace
+ORDER_FIELDS = [field.strip() for field in os.environ.get(
+    'ORDER_FIELDS',
+    'occ_date,occ_time,occ_date_time,rep_date,rep_time,rep_date_time,clearance_date,'
+    'latitude,longitude,x_coordinate,y_coordinate').split(',')
+    if field.strip()]
+# Fields whose values get per year/month/day counts of their records, fixed per namespace
+TIMESERIES_FIELDS = [field.strip() for field in os.environ.get('TIMESERIES_FIELDS', 'crime_type').split(',')
+                     if field.strip()]
+# Date field those counts are bucketed by
+TIMESERIES_DATE_FIELD = os.environ.get('TIMESERIES_DATE_FIELD', 'occ_date')
+# Time buckets of the counts and the period label format of each
+TIMESERIES_BUCKETS = {'year': '%Y', 'month': '%Y-%m', 'day': '%Y-%m-%d'}
+
+# How records are encoded: json, msgpack or msgpack+zstd (fixed per namespace when it is created)
+RECORD_CODEC = os.environ.get('RECORD_CODEC', 'msgpack')
+# 'keys' stores each record under its own key; 'buckets' packs records into RECORD_BUCKETS hashes
+RECORD_LAYOUT = os.environ.get('RECORD_LAYOUT', 'keys')
+RECORD_BUCKETS = int(os.environ.get('RECORD_BUCKETS', 8192))
+
+# Every full load goes into a fresh namespace dataset:v<n>:..., and readers follow the
+# dataset:active pointer, which is switched to the new namespace in a single SET.
+ACTIVE_KEY = 'dataset:active'
+NAMESPACE_COUNTER_KEY = 'dataset:namespaces'
+RETIRED_KEY = 'dataset:retired'
+# Bumped on every change readers can observe (load, incremental refresh, delete)
+VERSION_KEY = 'dataset:version'
+
+rd = redis.Redis(host=REDIS_IP, port=6379, db=0)
+
+
+def _batches(records, batch_size):
+    """Yield lists of at most `batch_size` items from an iterable of records."""
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def namespace_prefix(namespace):
+    """Return the key prefix shared by every key of dataset namespace `namespace`."""
+    return f"dataset:v{namespace}:"
+
+
+def record_key(namespace, record_id):
+    """Return the redis key holding the record with id `record_id` (its incident_report_number)."""
+    return f"{namespace_prefix(namespace)}record:{record_id}"
+
+
+def bucket_key(namespace, bucket):
+    """Return the key of hash bucket number `bucket` (layout 'buckets')."""
+    return f"{namespace_prefix(namespace)}bucket:{bucket}"
+
+
+def meta_key(namespace):
+    """Return the key of the hash holding a namespace's metadata (e.g. its high-water mark)."""
+    return f"{namespace_prefix(namespace)}meta"
+
+
+def ids_key(namespace):
+    """Return the key of the sorted set of every record id in `namespace` (all scores 0, so ids sort lexically)."""
+    return f"{namespace_prefix(namespace)}ids"
+
+
+def index_key(namespace, field, value):
+    """Return the key of the sorted set of ids of the records whose `field` equals `value`."""
+    return f"{namespace_prefix(namespace)}idx:{field}:{value}"
+
+
+def counts_key(namespace, field):
+    """Return the key of the hash counting how many records hold each value of `field`."""
+    return f"{namespace_prefix(namespace)}counts:{field}"
+
+
+def top_key(namespace, field):
+    """Return the key of the sorted set of the values of `field` scored by their count."""
+    return f"{namespace_prefix(namespace)}top:{field}"
+
+
+def present_key(namespace):
+    """Return the key of the hash counting how many records contain each field."""
+    return f"{namespace_prefix(namespace)}present"
+
+
+def order_key(namespace, field):
+    """Return the key of the sorted set of record ids scored by their value of `field`."""
+    return f"{namespace_prefix(namespace)}order:{field}"
+
+
+def timeseries_key(namespace, field, bucket, value):
+    """Return the key of the hash counting the records whose `field` equals `value` per `bucket` period."""
+    return f"{namespace_prefix(namespace)}ts:{field}:{bucket}:{value}"
+
+
+def timeseries_totals_key(namespace, field):
+    """Return the key of the sorted set of the values of `field` scored by their count of dated records."""
+    return f"{namespace_prefix(namespace)}ts:{field}:totals"
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def order_score(value):
+    """
+    Convert a field value into a sorted set score.
+
+    ISO dates and datetimes ('2023-01-01T00:00:00.000') become seconds since the epoch and
+    numeric strings ('1135', '30.2672') become floats.
+
+    Returns:
+        float: The score, or None for values that cannot be ordered numerically.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return (datetime.fromisoformat(value).replace(tzinfo=None) - _EPOCH).total_seconds()
+    except ValueError:
+        return None
+
+
+def active_namespace():
+    """Return the namespace readers currently see, or None when no dataset is loaded."""
+    value = rd.get(ACTIVE_KEY)
+    return value.decode('utf-8') if value is not None else None
+
+
+def check_settings():
+    """
+    Check that new loads can use RECORD_LAYOUT and RECORD_CODEC.
+
+    Raises:
+        ValueError: An unknown layout, or a codec that is unknown or whose package is not installed.
+    """
+    if RECORD_LAYOUT not in ('keys', 'buckets'):
+        raise ValueError(f"Unknown record layout: {RECORD_LAYOUT}")
+    get_codec(RECORD_CODEC)
+
+
+def new_namespace():
+    """Allocate a fresh, empty namespace for a full load, recording which fields it indexes."""
+    check_settings()
+    namespace = str(rd.incr(NAMESPACE_COUNTER_KEY))
+    rd.hset(meta_key(namespace), mapping={'indexed_fields': json.dumps(INDEXED_FIELDS),
+                                          'order_fields': json.dumps(ORDER_FIELDS),
+                                          'timeseries_fields': json.dumps(TIMESERIES_FIELDS),
+                                          'timeseries_date_field': TIMESERIES_DATE_FIELD,
+                                          'codec': RECORD_CODEC,
+                                          'layout': RECORD_LAYOUT,
+                                          'buckets': RECORD_BUCKETS})
+    return namespace
+
+
+_meta_cache = {}
+
+
+def namespace_meta(namespace):
+    """
+    Return the settings a namespace was created with (cached, as they never change).
+
+    Namespaces written before codecs and layouts existed read as JSON, one key per record;
+    those written before time-series rollups existed have none.
+
+    Returns:
+        dict: {'indexed_fields': [...], 'order_fields': [...], 'timeseries_fields': [...],
+        'timeseries_date_field': field or None, 'codec': codec object,
+        'layout': 'keys' or 'buckets', 'buckets': number of hash buckets}
+    """
+    meta = _meta_cache.get(namespace)
+    if meta is None:
+        (indexed_fields, order_fields, timeseries_fields, timeseries_date_field,
+         codec, layout, buckets, dictionary) = rd.hmget(
+            meta_key(namespace), 'indexed_fields', 'order_fields', 'timeseries_fields', 'timeseries_date_field',
+            'codec', 'layout', 'buckets', 'zstd_dict')
+        meta = {'indexed_fields': json.loads(indexed_fields) if indexed_fields else [],
+                'order_fields': json.loads(order_fields) if order_fields else [],
+                'timeseries_fields': json.loads(timeseries_fields) if timeseries_fields else [],
+                'timeseries_date_field': timeseries_date_field.decode('utf-8') if timeseries_date_field else None,
+                'codec': get_codec(codec.decode('utf-8') if codec else 'json', dictionary),
+                'dictionary': dictionary is not None,
+                'layout': layout.decode('utf-8') if layout else 'keys',
+                'buckets': int(buckets or RECORD_BUCKETS)}
+        _meta_cache[namespace] = meta
+    return meta
+
+
+def _train_codec(namespace, sample):
+    """Train the namespace's compression dictionary on the first batch of a fresh load."""
+    dictionary = train_dictionary(sample)
+    if dictionary is not None:
+        rd.hset(meta_key(namespace), 'zstd_dict', dictionary)
+        _meta_cache.pop(namespace, None)
+        logging.info(f"Trained a {len(dictionary)} byte zstd dictionary for namespace {namespace}")
+
+
+def activate(namespace):
+    """
+    Atomically point readers at `namespace` and retire the namespace it replaces.
+
+    Args:
+        namespace (str): A fully loaded namespace.
+    """
+    pipe = rd.pipeline()
+    pipe.set(ACTIVE_KEY, namespace, get=True)
+    pipe.incr(VERSION_KEY)
+    previous, _ = pipe.execute()
+    logging.info(f"Dataset namespace {namespace} is now active")
+    if previous is not None:
+        retire(previous.decode('utf-8'))
+
+
+def deactivate():
+    """Atomically unload the active dataset and retire its namespace."""
+    pipe = rd.pipeline()
+    pipe.getdel(ACTIVE_KEY)
+    pipe.incr(VERSION_KEY)
+    previous, _ = pipe.execute()
+    if previous is not None:
+        retire(previous.decode('utf-8'))
+
+
+def dataset_version():
+    """Return the dataset version counter, bumped whenever the visible dataset changes."""
+    return int(rd.get(VERSION_KEY) or 0)
+
+
+def bump_version():
+    """Mark the visible dataset as changed (e.g. after an incremental refresh)."""
+    return rd.incr(VERSION_KEY)
+
+
+def retire(namespace, grace=None):
+    """
+    Reclaim `namespace` on a background thread once readers have had `grace` seconds to finish.
+
+    The namespace stays listed in dataset:retired until it is gone, so a reclaim cut short by
+    a restart is picked up again by reclaim_retired().
+    """
+    grace = RECLAIM_GRACE_SECONDS if grace is None else grace
+    rd.sadd(RETIRED_KEY, namespace)
+    timer = threading.Timer(grace, reclaim, args=(namespace,))
+    timer.daemon = True
+    timer.start()
+
+
+def reclaim(namespace, batch_size=None):
+    """
+    Delete every key of `namespace` with batched, non-blocking UNLINKs.
+
+    Returns:
+        int: Number of keys unlinked.
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    rd.srem(RETIRED_KEY, namespace)
+    if namespace == active_namespace():
+        logging.warning(f"Refusing to reclaim active dataset namespace {namespace}")
+        return 0
+    # readers check the meta hash to tell a reclaimed namespace from an empty one
+    unlinked = rd.unlink(meta_key(namespace))
+    _meta_cache.pop(namespace, None)
+    keys = rd.scan_iter(match=f"{namespace_prefix(namespace)}*", count=batch_size)
+    for batch in _batches(keys, batch_size):
+        unlinked += rd.unlink(*batch)
+    logging.info(f"Reclaimed dataset namespace {namespace} ({unlinked} keys)")
+    return unlinked
+
+
+def reclaim_retired():
+    """Reclaim every namespace still listed in dataset:retired."""
+    for namespace in rd.smembers(RETIRED_KEY):
+        reclaim(namespace.decode('utf-8'))
+
+
+def _periods(value):
+    """Return the period of an ISO date in each time bucket, e.g. {'year': '2023', 'month': '2023-01', ...}."""
+    if not isinstance(value, str):
+        return None
+    try:
+        day = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return {bucket: day.strftime(label) for bucket, label in TIMESERIES_BUCKETS.items()}
+
+
+def _rollups(meta, record):
+    """
+    Return the time-series counters a record contributes to.
+
+    Returns:
+        set: (field, value, bucket, period) per bucket, and (field, value, None, None) for the
+        value's total, for every rolled-up field with a string value; empty without a valid date.
+    """
+    if record is None or not meta.get('timeseries_fields'):
+        return set()
+    periods = _periods(record.get(meta['timeseries_date_field']))
+    if periods is None:
+        return set()
+    members = set()
+    for field in meta['timeseries_fields']:
+        value = record.get(field)
+        if isinstance(value, str):
+            members.add((field, value, None, None))
+            members.update((field, value, bucket, period) for bucket, period in periods.items())
+    return members
+
+
+def _update_indexes(pipe, namespace, meta, record_id, old, new, counts):
+    """
+    Queue the index changes for replacing record `old` (None if it is new) with `new`.
+
+    Value, field-presence and time-series counters are not written here; their changes are summed
+    into `counts` so write_batch() can apply them with one HINCRBY per distinct value or period.
+
+    Args:
+        pipe (redis.client.Pipeline): Pipeline the commands are added to.
+        namespace (str): Dataset namespace being written.
+        meta (dict): The namespace's settings, from namespace_meta().
+        record_id (str): The record's incident_report_number.
+        old (dict): The stored version of the record, or None.
+        new (dict): The version being written.
+        counts (collections.Counter): Counter deltas keyed by (field, value), where value None counts
+            presence, or by the (field, value, bucket, period) of a time-series counter.
+    """
+    if old is None:
+        pipe.zadd(ids_key(namespace), {record_id: 0})
+    old_rollups, new_rollups = _rollups(meta, old), _rollups(meta, new)
+    if old_rollups != new_rollups:
+        for member in old_rollups - new_rollups:
+            counts[member] -= 1
+        for member in new_rollups - old_rollups:
+            counts[member] += 1
+    old_fields = set(old) if old is not None else set()
+    for field in old_fields.symmetric_difference(new):
+        counts[(field, None)] += 1 if field in new else -1
+    for field in meta['indexed_fields']:
+        old_value = old.get(field) if old is not None else None
+        new_value = new.get(field)
+        if old_value == new_value:
+            continue
+        if isinstance(old_value, str):
+            pipe.zrem(index_key(namespace, field, old_value), record_id)
+            counts[(field, old_value)] -= 1
+        if isinstance(new_value, str):
+            pipe.zadd(index_key(namespace, field, new_value), {record_id: 0})
+            counts[(field, new_value)] += 1
+    for field in meta['order_fields']:
+        old_value = old.get(field) if old is not None else None
+        new_value = new.get(field)
+        if old is not None and old_value == new_value:
+            continue
+        score = order_score(new_value)
+        if score is not None:
+            pipe.zadd(order_key(namespace, field), {record_id: score})
+        elif order_score(old_value) is not None:
+            pipe.zrem(order_key(namespace, field), record_id)
+
+
+def _apply_counts(pipe, namespace, counts):
+    """Queue the summed counter changes collected by _update_indexes()."""
+    for key, delta in counts.items():
+        if delta == 0:
+            continue
+        if len(key) == 4:
+            field, value, bucket, period = key
+            if bucket is None:
+                pipe.zincrby(timeseries_totals_key(namespace, field), delta, value)
+            else:
+                pipe.hincrby(timeseries_key(namespace, field, bucket, value), period, delta)
+            continue
+        field, value = key
+        if value is None:
+            pipe.hincrby(present_key(namespace), field, delta)
+        else:
+            pipe.hincrby(counts_key(namespace, field), value, delta)
+            pipe.zincrby(top_key(namespace, field), delta, value)
+
+
+def _bucket_of(meta, record_id):
+    return zlib.crc32(record_id.encode('utf-8')) % meta['buckets']
+
+
+def _queue_store(pipe, namespace, meta, record_id, item):
+    """Queue the write of one encoded record in the namespace's layout."""
+    raw = meta['codec'].encode(item)
+    if meta['layout'] == 'buckets':
+        pipe.hset(bucket_key(namespace, _bucket_of(meta, record_id)), record_id, raw)
+    else:
+        pipe.set(record_key(namespace, record_id), raw)
+
+
+def _load_raw(namespace, meta, record_ids):
+    """Return the stored (encoded) records with the given ids in one round trip; None for missing ones."""
+    if meta['layout'] == 'buckets':
+        pipe = rd.pipeline(transaction=False)
+        for record_id in record_ids:
+            pipe.hget(bucket_key(namespace, _bucket_of(meta, record_id)), record_id)
+        return pipe.execute()
+    return rd.mget([record_key(namespace, record_id) for record_id in record_ids])
+
+
+def write_batch(batch, namespace, replace=False):
+    """
+    Upsert one batch of records and their index entries, keyed by incident_report_number.
+
+    A fresh namespace is written with one pipelined round trip. With `replace`, the stored
+    versions of the records are fetched first (one round trip) so their old index entries can
+    be removed, and the batch is applied as one MULTI so readers never see it half-indexed.
+
+    Args:
+        batch (list): Records (dicts) to write.
+        namespace (str): Dataset namespace to write into.
+        replace (bool): Records may already exist in `namespace` (incremental refresh).
+
+    Returns:
+        int: Number of records written; records without an incident_report_number are skipped.
+    """
+    items = {}
+    for item in batch:
+        record_id = item.get('incident_report_number')
+        if record_id is None:
+            logging.warning(f"Skipping record without incident_report_number: {item}")
+            continue
+        items[record_id] = item
+    if not items:
+        return 0
+
+    meta = namespace_meta(namespace)
+    previous = {}
+    if replace:
+        stored = _load_raw(namespace, meta, list(items))
+        previous = {record_id: meta['codec'].decode(value)
+                    for record_id, value in zip(items, stored) if value is not None}
+
+    counts = Counter()
+    pipe = rd.pipeline(transaction=replace)
+    for record_id, item in items.items():
+        _queue_store(pipe, namespace, meta, record_id, item)
+        _update_indexes(pipe, namespace, meta, record_id, previous.get(record_id), item, counts)
+    _apply_counts(pipe, namespace, counts)
+    pipe.execute()
+    return len(items)
+
+
+class NamespaceReclaimed(Exception):
+    """The namespace being read was reclaimed part way through the read."""
+
+
+def scan_records(namespace, cursor=0, count=None):
+    """
+    Run one SCAN step over the records of `namespace` and fetch them in one more round trip.
+
+    Args:
+        namespace (str): Dataset namespace to read.
+        cursor (int): SCAN cursor; 0 starts a new walk.
+        count (int): SCAN COUNT hint; defaults to INGEST_BATCH_SIZE.
+
+    Returns:
+        tuple: (next cursor, 0 once the walk is complete; list of records from this step).
+    """
+    meta = namespace_meta(namespace)
+    codec = meta['codec']
+    if meta['layout'] == 'buckets':
+        # each bucket holds many records, so scan proportionally fewer keys per step
+        count = max(1, (count or INGEST_BATCH_SIZE) * meta['buckets'] // max(1, rd.zcard(ids_key(namespace))))
+        cursor, keys = rd.scan(cursor, match=bucket_key(namespace, '*'), count=count)
+        pipe = rd.pipeline(transaction=False)
+        for key in keys:
+            pipe.hvals(key)
+        return cursor, [codec.decode(value) for values in pipe.execute() for value in values]
+    cursor, keys = rd.scan(cursor, match=record_key(namespace, '*'), count=count or INGEST_BATCH_SIZE)
+    if not keys:
+        return cursor, []
+    return cursor, [codec.decode(value) for value in rd.mget(keys) if value is not None]
+
+
+def iter_record_batches(count=None):
+    """
+    Walk the active dataset with SCAN, yielding each step's records as soon as they are decoded.
+
+    Memory stays bounded by one SCAN step however large the dataset is, and redis is never
+    blocked by a full keyspace walk.
+
+    Yields:
+        list: The records found by one SCAN step (possibly empty).
+
+    Raises:
+        NamespaceReclaimed: A reload retired the namespace and it was reclaimed mid-walk, so the
+            remaining steps would silently find nothing.
+    """
+    namespace = active_namespace()
+    if namespace is None:
+        return
+    cursor = 0
+    while True:
+        cursor, records = scan_records(namespace, cursor, count)
+        # reclaim() drops the meta hash first, so records read before it still exists are complete
+        if not namespace_exists(namespace):
+            logging.warning(f"Dataset namespace {namespace} was reclaimed while it was being read")
+            raise NamespaceReclaimed(f"Dataset namespace {namespace} was reclaimed while it was being read")
+        yield records
+        if cursor == 0:
+            return
+
+
+def all_records():
+    """Return every record of the active dataset, fetched with batched MGETs."""
+    data = []
+    for records in iter_record_batches():
+        data.extend(records)
+    return data
+
+
+def namespace_exists(namespace):
+    """Return True while `namespace` is still readable (active, or retired but not yet reclaimed)."""
+    return bool(rd.exists(meta_key(namespace)))
+
+
+def _decode_ids(ids):
+    return [record_id.decode('utf-8') for record_id in ids]
+
+
+def list_records(after=None, limit=1000, namespace=None):
+    """
+    Page through every record in incident_report_number order, resuming after id `after`.
+
+    Costs O(log n + page size) however deep the page is: one ZRANGEBYLEX on the id set
+    and one MGET.
+
+    Args:
+        after (str): Last id of the previous page, or None for the first page.
+        limit (int): Maximum number of records to return.
+        namespace (str): Namespace to read; defaults to the active one.
+
+    Returns:
+        dict: {'namespace', 'total': records in the dataset, 'records': the page,
+        'last_id': id of the last record of the page, 'more': whether another page may follow}.
+    """
+    namespace = namespace or active_namespace()
+    if namespace is None:
+        return {'namespace': None, 'total': 0, 'records': [], 'last_id': None, 'more': False}
+    key = ids_key(namespace)
+    pipe = rd.pipeline(transaction=False)
+    pipe.zcard(key)
+    pipe.zrangebylex(key, f"({after}" if after is not None else '-', '+', start=0, num=limit)
+    total, page = pipe.execute()
+    page = _decode_ids(page)
+    return {'namespace': namespace,
+            'total': total,
+            'records': fetch_records(namespace, page),
+            'last_id': page[-1] if page else None,
+            'more': bool(page) and len(page) == limit}
+
+
+def find_records(param, value, offset=0, limit=None, after=None, namespace=None):
+    """
+    Look up the records whose `param` equals `value` through the namespace's index.
+
+    Costs O(log n + page size): the counts come from ZCARD and only the requested page of
+    ids is read from the index and fetched with one MGET.
+
+    Args:
+        param (str): Field to filter on.
+        value (str): Value the field must equal.
+        offset (int): Number of matches to skip (ignored when `after` is given).
+        limit (int): Maximum number of matches to return (None for all of them; 0 for none).
+        after (str): Resume after this record id (keyset pagination).
+        namespace (str): Namespace to read; defaults to the active one.
+
+    Returns:
+        dict: {'namespace', 'total': records in the dataset, 'matched': matching records,
+        'records': the page, 'last_id': id of the last record of the page, 'more': whether
+        another page may follow}, or None when `param` is not indexed and the caller has to
+        scan the snapshot instead.
+    """
+    namespace = namespace or active_namespace()
+    if namespace is None:
+        return {'namespace': None, 'total': 0, 'matched': 0, 'records': [], 'last_id': None, 'more': False}
+    if param not in namespace_meta(namespace)['indexed_fields']:
+        return None
+    key = index_key(namespace, param, value)
+    pipe = rd.pipeline(transaction=False)
+    pipe.zcard(ids_key(namespace))
+    pipe.zcard(key)
+    if limit is not None and limit <= 0:
+        # ZRANGE would read offset + limit - 1 as a rank from the end
+        total, matched = pipe.execute()
+        page = []
+    else:
+        if after is not None:
+            pipe.zrangebylex(key, f"({after}", '+', start=0, num=limit if limit is not None else -1)
+        else:
+            pipe.zrange(key, offset, -1 if limit is None else offset + limit - 1)
+        total, matched, page = pipe.execute()
+        page = _decode_ids(page)
+    return {'namespace': namespace,
+            'total': total,
+            'matched': matched,
+            'records': fetch_records(namespace, page),
+            'last_id': page[-1] if page else None,
+            'more': bool(page) and limit is not None and len(page) == limit}
+
+
+def _range_slices(key, start, stop, descending=False):
+    """Return the ids of ranks [start, stop) of sorted set `key`, one ZRANGE of INGEST_BATCH_SIZE at a time."""
+    ids = []
+    for first in range(start, stop, INGEST_BATCH_SIZE):
+        ids.extend(rd.zrange(key, first, min(first + INGEST_BATCH_SIZE, stop) - 1, desc=descending))
+    return ids
+
+
+def order_records(param, descending=False, offset=0, limit=None, namespace=None):
+    """
+    Page through the records ordered by `param` using the namespace's ordering index.
+
+    Costs O(log n + page size): one ZRANGE/ZREVRANGE by rank for the page of ids and one
+    MGET. Records with equal values are ordered by incident_report_number. Without a limit,
+    the ids and records are read INGEST_BATCH_SIZE at a time so no single command blocks
+    redis for the whole dataset.
+
+    Args:
+        param (str): Numeric or date field to order by.
+        descending (bool): Largest values first.
+        offset (int): Rank of the first record to return (not negative).
+        limit (int): Maximum number of records to return (None for all of them; 0 for none).
+        namespace (str): Namespace to read; defaults to the active one.
+
+    Returns:
+        dict: {'namespace', 'total': records in the dataset, 'matched': records with an
+        orderable `param`, 'records': the page, 'next_offset': rank of the next page or None},
+        or None when `param` has no ordering index.
+    """
+    namespace = namespace or active_namespace()
+    if namespace is None:
+        return {'namespace': None, 'total': 0, 'matched': 0, 'records': [], 'next_offset': None}
+    if param not in namespace_meta(namespace)['order_fields']:
+        return None
+    key = order_key(namespace, param)
+    pipe = rd.pipeline(transaction=False)
+    pipe.zcard(ids_key(namespace))
+    pipe.zcard(key)
+    if limit is not None and limit <= 0:
+        # ZRANGE would read offset + limit - 1 as a rank from the end
+        total, matched = pipe.execute()
+        page = []
+    elif limit is None:
+        total, matched = pipe.execute()
+        page = _range_slices(key, offset, matched, descending)
+    else:
+        pipe.zrange(key, offset, offset + limit - 1, desc=descending)
+        total, matched, page = pipe.execute()
+    next_offset = offset + len(page)
+    if not page:
+        # an empty page never leads to another one
+        next_offset = matched
+    return {'namespace': namespace,
+            'total': total,
+            'matched': matched,
+            'records': fetch_records(namespace, _decode_ids(page)),
+            'next_offset': next_offset if next_offset < matched else None}
+
+
+def value_counts(param):
+    """
+    Return the precomputed counts of every value of `param`, read in one round trip.
+
+    Returns:
+        dict: {'total': records in the dataset, 'present': records containing `param`,
+        'counts': {value: occurrences}}, or None when `param` is not counted and the
+        caller has to scan the snapshot instead.
+    """
+    namespace = active_namespace()
+    if namespace is None:
+        return {'total': 0, 'present': 0, 'counts': {}}
+    if param not in namespace_meta(namespace)['indexed_fields']:
+        return None
+    pipe = rd.pipeline(transaction=False)
+    pipe.zcard(ids_key(namespace))
+    pipe.hget(present_key(namespace), param)
+    pipe.hgetall(counts_key(namespace, param))
+    total, present, counts = pipe.execute()
+    return {'total': total,
+            'present': int(present or 0),
+            'counts': {value.decode('utf-8'): int(count)
+                       for value, count in counts.items() if int(count) > 0}}
+
+
+def top_values(param, k=5):
+    """
+    Return the `k` most frequent values of `param` from its ordered counter.
+
+    Returns:
+        dict: {value: occurrences} in descending order of occurrences, or None when `param`
+        is not counted.
+    """
+    namespace = active_namespace()
+    if namespace is None:
+        return {}
+    if param not in namespace_meta(namespace)['indexed_fields']:
+        return None
+    top = rd.zrevrangebyscore(top_key(namespace, param), '+inf', 1, start=0, num=k, withscores=True)
+    return {value.decode('utf-8'): int(count) for value, count in top}
+
+
+def timeseries(field, bucket, top=None):
+    """
+    Return the per-period record counts of the most frequent values of `field` from its rollups.
+
+    Reads the ordered totals and one hash per returned value, so the cost grows with the number
+    of periods and values returned, not with the number of records.
+
+    Args:
+        field (str): A field in the namespace's TIMESERIES_FIELDS.
+        bucket (str): 'year', 'month' or 'day'.
+        top (int): Only the `top` values with the most dated records; None for all of them.
+
+    Returns:
+        dict: {'periods': [period, ...] in ascending order, 'series': {value: [count per period]}}
+        with values in descending order of their total, or None when `field` is not rolled up.
+    """
+    namespace = active_namespace()
+    if namespace is None:
+        return {'periods': [], 'series': {}}
+    if field not in namespace_meta(namespace)['timeseries_fields']:
+        return None
+    values = rd.zrevrangebyscore(timeseries_totals_key(namespace, field), '+inf', 1,
+                                 start=0, num=top if top else -1)
+    values = [value.decode('utf-8') for value in values]
+    pipe = rd.pipeline(transaction=False)
+    for value in values:
+        pipe.hgetall(timeseries_key(namespace, field, bucket, value))
+    counts = [{period.decode('utf-8'): int(count) for period, count in raw.items() if int(count) > 0}
+              for raw in pipe.execute()]
+    periods = sorted({period for per_period in counts for period in per_period})
+    return {'periods': periods,
+            'series': {value: [per_period.get(period, 0) for period in periods]
+                       for value, per_period in zip(values, counts)}}
+
+
+def fetch_records(namespace, record_ids):
+    """Return the records with the given ids from `namespace`, in order, one round trip per INGEST_BATCH_SIZE ids."""
+    if not record_ids:
+        return []
+    meta = namespace_meta(namespace)
+    return [meta['codec'].decode(value)
+            for batch in _batches(record_ids, INGEST_BATCH_SIZE)
+            for value in _load_raw(namespace, meta, batch) if value is not None]
+
+
+def _deep_sizeof(obj):
+    """Approximate the memory held by a decoded JSON value."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(key) + _deep_sizeof(value) for key, value in obj.items())
+    elif isinstance(obj, list):
+        size += sum(_deep_sizeof(item) for item in obj)
+    return size
+
+
+def _estimate_size(data, sample_size=100):
+    """Estimate the memory held by a list of records from a sample of them."""
+    if not data:
+        return sys.getsizeof(data)
+    sample = data[:sample_size]
+    per_record = sum(_deep_sizeof(item) for item in sample) / len(sample)
+    return int(sys.getsizeof(data) + per_record * len(data))
+
+
+_snapshot_lock = threading.Lock()
+_snapshot = {'version': None, 'records': None, 'bytes': 0}
+_snapshot_stats = {'hits': 0, 'misses': 0, 'over_budget': 0, 'builds': 0, 'build_seconds': 0.0}
+
+
+def snapshot():
+    """
+    Return the parsed records of the active dataset, cached per process.
+
+    The cached list is rebuilt only when the dataset version changes, so a request costs
+    one GET instead of a full scan. Callers must treat the returned records as read-only.
+    A dataset whose estimated size exceeds SNAPSHOT_MAX_BYTES is returned but not cached.
+
+    Returns:
+        list: Every record of the active dataset.
+    """
+    version = dataset_version()
+    with _snapshot_lock:
+        if _snapshot['version'] == version:
+            _snapshot_stats['hits'] += 1
+            return _snapshot['records']
+        _snapshot_stats['misses'] += 1
+        start = time.perf_counter()
+        # the version is read before the records so a concurrent reload can only make
+        # the snapshot newer than its label, never older
+        data = all_records()
+        _snapshot_stats['builds'] += 1
+        _snapshot_stats['build_seconds'] += time.perf_counter() - start
+        size = _estimate_size(data)
+        if size > SNAPSHOT_MAX_BYTES:
+            _snapshot_stats['over_budget'] += 1
+            logging.warning(f"Dataset snapshot (~{size} bytes) exceeds SNAPSHOT_MAX_BYTES; not caching it")
+            _snapshot.update(version=None, records=None, bytes=0)
+        else:
+            _snapshot.update(version=version, records=data, bytes=size)
+        return data
+
+
+def snapshot_stats():
+    """Return the snapshot cache's version, size, memory budget and hit/miss counters."""
+    with _snapshot_lock:
+        lookups = _snapshot_stats['hits'] + _snapshot_stats['misses']
+        return {'version': _snapshot['version'],
+                'records': len(_snapshot['records']) if _snapshot['records'] is not None else 0,
+                'bytes': _snapshot['bytes'],
+                'max_bytes': SNAPSHOT_MAX_BYTES,
+                'hit_ratio': round(_snapshot_stats['hits'] / lookups, 3) if lookups else None,
+                **_snapshot_stats,
+                'build_seconds': round(_snapshot_stats['build_seconds'], 3)}
+
+
+def get_high_water_mark(namespace):
+    """Return the newest upstream :updated_at loaded into `namespace`, or None."""
+    value = rd.hget(meta_key(namespace), 'high_water_mark')
+    return value.decode('utf-8') if value is not None else None
+
+
+def set_high_water_mark(namespace, value):
+    """Record `value` as the newest upstream :updated_at loaded into `namespace`."""
+    rd.hset(meta_key(namespace), 'high_water_mark', value)
+
+
+def load_records(records, namespace, batch_size=None, replace=False):
+    """
+    Bulk-upsert records into `namespace`, `batch_size` records per round trip.
+
+    Args:
+        records (iterable): Records (dicts) to load.
+        namespace (str): Dataset namespace to write into.
+        batch_size (int): Records per pipeline; defaults to INGEST_BATCH_SIZE.
+        replace (bool): Records may already exist in `namespace` (incremental refresh).
+
+    Returns:
+        dict: Ingest statistics (rows, batches, seconds, rows_per_second).
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    rows = 0
+    batches = 0
+    start = time.perf_counter()
+    for batch in _batches(records, batch_size):
+        if batches == 0 and not replace:
+            meta = namespace_meta(namespace)
+            if meta['codec'].trainable and not meta['dictionary']:
+                _train_codec(namespace, batch)
+        rows += write_batch(batch, namespace, replace)
+        batches += 1
+    seconds = time.perf_counter() - start
+    stats = {'rows': rows,
+             'batches': batches,
+             'batch_size': batch_size,
+             'seconds': round(seconds, 3),
+             'rows_per_second': round(rows / seconds, 1) if seconds > 0 else float(rows)}
+    logging.info(f"Loaded {rows} records in {batches} batches ({stats['rows_per_second']} rows/s)")
+    return stats
@@ -0,0 +1,247 @@
+import os
+import json
+import codecs
+import queue
+import threading
+import logging
+from upstream import fetch_chunks
+from dataset import (load_records, get_high_water_mark, set_high_water_mark,
+                     active_namespace, new_namespace, activate, reclaim, bump_version)
+
+# Read the value of the LOG_LEVEL environment variable
+log_level = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=log_level)
+
+url = "https://data.austintexas.gov/resource/fdj4-gpfu.json"
+
+# Records requested per upstream page ($limit)
+INGEST_PAGE_SIZE = int(os.environ.get('INGEST_PAGE_SIZE', 10000))
+# Pages downloaded ahead of the one currently being written to redis
+INGEST_PREFETCH_PAGES = int(os.environ.get('INGEST_PREFETCH_PAGES', 1))
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parse a JSON array, yielding each element as soon as it is complete.
+
+    Args:
+        chunks (iterable): Byte chunks of a JSON document whose top level is an array of objects.
+
+    Yields:
+        dict: One decoded element of the array at a time.
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    started = False
+    exhausted = False
+
+    while True:
+        # skip whitespace and separators between elements
+        while pos < len(buf) and buf[pos] in _WHITESPACE + ',':
+            if buf[pos] == ',' and not started:
+                raise ValueError("Malformed JSON array")
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            else:
+                yield item
+                pos = end
+                continue
+        elif exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        # need more input: drop the consumed prefix and read the next chunk
+        buf = buf[pos:]
+        pos = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            buf += utf8.decode(b'', final=True)
+            exhausted = True
+        else:
+            buf += utf8.decode(chunk)
+
+
+def iter_pages(source_url=url, page_size=None, where=None, order=':id'):
+    """
+    Walk the Socrata endpoint page by page with $limit/$offset.
+
+    Args:
+        source_url (str): Socrata resource url.
+        page_size (int): Records per page; defaults to INGEST_PAGE_SIZE.
+        where (str): Optional SoQL $where filter.
+        order (str): SoQL $order clause; must be deterministic for offsets to be stable.
+
+    Yields:
+        list: The records of one page, parsed as the response body streams in.
+    """
+    page_size = page_size or INGEST_PAGE_SIZE
+    offset = 0
+    while True:
+        # ':*' adds the system fields (:id, :updated_at) used for incremental refreshes
+        params = {'$select': ':*, *', '$limit': page_size, '$offset': offset, '$order': order}
+        if where:
+            params['$where'] = where
+        # incremental filters are one-off queries, so only full-load pages go through the disk cache
+        chunks = fetch_chunks(source_url, params, cache=where is None)
+        page = list(iter_json_array(chunks))
+        # the parser stops at the closing ']'; read to the end so the page is published to the cache
+        for _ in chunks:
+            pass
+        logging.debug(f"Fetched page at offset {offset} ({len(page)} records)")
+        # an empty page ends the listing even if the endpoint ignored page_size
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+
+def _strip_system_fields(records, marks):
+    """
+    Drop Socrata system fields (':id', ':updated_at', ...) from each record before it is stored.
+
+    Args:
+        records (iterable): Records as returned by the endpoint.
+        marks (dict): Updated in place; marks['high_water_mark'] tracks the newest :updated_at seen.
+
+    Yields:
+        dict: The record without its system fields.
+    """
+    for item in records:
+        updated_at = item.get(':updated_at')
+        if updated_at is not None and (marks.get('high_water_mark') is None
+                                       or updated_at > marks['high_water_mark']):
+            marks['high_water_mark'] = updated_at
+        yield {key: value for key, value in item.items() if not key.startswith(':')}
+
+
+def _prefetch(pages, depth):
+    """
+    Run the `pages` iterator on a background thread, `depth` pages ahead of the consumer.
+
+    Closing the generator (or abandoning it after an error) stops the thread, which would
+    otherwise stay blocked on the full buffer holding a page.
+
+    Yields:
+        list: Pages in order; exceptions raised while fetching are re-raised here.
+    """
+    done = object()
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(done)
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            page = buffer.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        stop.set()
+
+
+def ingest(source_url=url, page_size=None, batch_size=None, incremental=False):
+    """
+    Load the upstream dataset into redis, writing each page while the next one downloads.
+
+    A full load is written into a fresh namespace that readers are switched to only once it
+    is complete; the namespace it replaces is reclaimed in the background. In incremental
+    mode only rows whose :updated_at is newer than the active dataset's high-water mark are
+    fetched and upserted in place; without an active dataset the whole dataset is loaded.
+
+    Args:
+        source_url (str): Socrata resource url.
+        page_size (int): Records per upstream page.
+        batch_size (int): Records per redis pipeline.
+        incremental (bool): Fetch only rows changed since the last load.
+
+    Returns:
+        dict: Ingest statistics (mode, namespace, high_water_mark, pages, rows, batches, seconds, rows_per_second).
+    """
+    pages = 0
+    namespace = active_namespace() if incremental else None
+    previous_mark = get_high_water_mark(namespace) if namespace is not None else None
+    marks = {'high_water_mark': previous_mark}
+    if previous_mark is not None:
+        mode = 'incremental'
+        where = f":updated_at > '{previous_mark}'"
+        order = ':updated_at, :id'
+    else:
+        mode = 'full'
+        namespace = new_namespace()
+        where = None
+        order = ':id'
+
+    def records():
+        nonlocal pages
+        fetched = _prefetch(iter_pages(source_url, page_size, where, order), INGEST_PREFETCH_PAGES)
+        try:
+            for page in fetched:
+                pages += 1
+                yield from _strip_system_fields(page, marks)
+        finally:
+            fetched.close()
+
+    source = records()
+    try:
+        stats = load_records(source, namespace, batch_size, replace=(mode == 'incremental'))
+    except Exception:
+        if mode == 'full':
+            # readers never saw the partial load; drop it
+            reclaim(namespace)
+        raise
+    finally:
+        # stops the prefetch thread if the load failed part way
+        source.close()
+    # only advance the mark once every page has been written
+    if marks['high_water_mark'] is not None and marks['high_water_mark'] != previous_mark:
+        set_high_water_mark(namespace, marks['high_water_mark'])
+    if mode == 'full':
+        activate(namespace)
+    elif stats['rows']:
+        bump_version()
+    return {'mode': mode,
+            'namespace': namespace,
+            'high_water_mark': marks['high_water_mark'],
+            'pages': pages,
+            **stats}
@@ -1,10 +1,13 @@
 
 import json
 import uuid
+import time
+import hashlib
 import redis
 from hotqueue import HotQueue
 import os
 import logging
+from dataset import dataset_version
     
 # Read the value of the LOG_LEVEL environment variable
 log_level = os.getenv("LOG_LEVEL", "INFO")
@@ -15,8 +18,53 @@ REDIS_IP = os.environ.get('REDIS_IP')
 _list_of_jobs = []
     
 rd = redis.Redis(host=REDIS_IP, port=6379, db=0)
-q = HotQueue("queue", host=REDIS_IP, port=6379, db=1)
 jdb = redis.Redis(host=REDIS_IP, port=6379, db=2)
+res = redis.Redis(host=REDIS_IP, port=6379, db=3)
+
+def _parse_pairs(raw):
+    """Parse 'name:value,name:value' settings into (name, value) pairs."""
+    return [tuple(item.strip().split(':', 1)) for item in raw.split(',') if item.strip()]
+
+# Queue lanes and their weights: workers take jobs from each lane in proportion to its weight
+JOB_LANES = {lane: int(weight) for lane, weight in _parse_pairs(os.environ.get('JOB_LANES', 'high:4,normal:2,low:1'))}
+# Lane of the jobs whose type has no lane below (and that ask for none)
+JOB_DEFAULT_LANE = os.environ.get('JOB_DEFAULT_LANE', 'normal')
+# Lane of each job type: cheap histograms are not held up by a backlog of heavy line plots
+JOB_TYPE_LANES = dict(_parse_pairs(os.environ.get('JOB_TYPE_LANES', 'histogram:high,line:low')))
+# Most jobs queued over all lanes before submissions are refused (0: unbounded)
+JOB_MAX_QUEUE_DEPTH = int(os.environ.get('JOB_MAX_QUEUE_DEPTH', 1000))
+# Seconds a refused client is told to wait before submitting again
+JOB_RETRY_AFTER_SECONDS = int(os.environ.get('JOB_RETRY_AFTER_SECONDS', 5))
+
+# One queue per lane; they live next to the job records so a job is saved and queued in one round trip
+queues = {lane: HotQueue(f"queue:{lane}", host=REDIS_IP, port=6379, db=2) for lane in JOB_LANES}
+q = queues[JOB_DEFAULT_LANE]
+# HASH of '<lane>:taken' and '<lane>:wait_seconds' (queued time of the jobs taken) counters
+QUEUE_STATS_KEY = 'queue:stats'
+
+# Reuse the rendered result of an identical job (same type, params and dataset version)
+JOB_DEDUP = os.environ.get('JOB_DEDUP', '1') == '1'
+# Seconds a finished (completed, failed or expired) job record is kept
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 7 * 24 * 3600))
+FINISHED_STATUSES = ('completed', 'failed', 'expired')
+STATUSES = ('submitted', 'in progress') + FINISHED_STATUSES
+# Job types the worker knows how to render
+JOB_TYPES = ('histogram', 'line')
+# Seconds a render may stay in flight before identical submissions stop waiting for it
+JOB_INFLIGHT_TTL = int(os.environ.get('JOB_INFLIGHT_TTL', 600))
+
+# Job index: every job by submit time, and each status's jobs by the time they entered it
+JOB_INDEX_KEY = 'jobs:index'
+    
+# Every status change is published on this channel (per job) for long-polls and event streams
+def events_channel(jid):
+    """Pub/sub channel announcing the status changes of job `jid`."""
+    return f'jobs:events:{jid}'
+    
+# Job records are hashes; these fields are not plain strings
+_JSON_FIELDS = ('params',)
+_INT_FIELDS = ('dataset_version',)
+_TIME_FIELDS = ('submitted_at', 'started_at', 'finished_at', 'updated_at')
 
 def _generate_jid():
     """
@@ -24,52 +72,569 @@ def _generate_jid():
     """
     return str(uuid.uuid4())
     
-def _instantiate_job(jid, status, job_type, params):
+def _instantiate_job(jid, status, job_type, params, version=None):
     """
     Create the job object description as a python dictionary. Requires the job id,
-    status, start and end parameters.
+    status, start and end parameters, and optionally the dataset version it was submitted against.
     """
-    return {'id': jid,
-            'status': status,
-            'job_type': job_type,
-            'params': params
-            }
+    job_dict = {'id': jid,
+                'status': status,
+                'job_type': job_type,
+                'params': params
+                }
+    if version is not None:
+        job_dict['dataset_version'] = version
+    return job_dict
+    
+def _encode_job(fields):
+    """Encode job fields as hash field values."""
+    return {name: json.dumps(value) if name in _JSON_FIELDS else str(value)
+            for name, value in fields.items() if value is not None}
+    
+def _decode_job(raw):
+    """Decode a job hash read from redis (None if the job does not exist)."""
+    if not raw:
+        return None
+    job_dict = {}
+    for name, value in raw.items():
+        name = name.decode('utf-8')
+        value = value.decode('utf-8')
+        if name in _JSON_FIELDS:
+            value = json.loads(value)
+        elif name in _INT_FIELDS:
+            value = int(value)
+        elif name in _TIME_FIELDS:
+            value = float(value)
+        job_dict[name] = value
+    return job_dict
+    
+def status_key(status):
+    """Key of the sorted set of the jobs currently in `status`."""
+    return f'jobs:status:{status}'
+    
+def _index_status(pipe, jid, status, score):
+    """Queue moving `jid` into the index of `status` (and out of every other status)."""
+    for other in STATUSES:
+        if other != status:
+            pipe.zrem(status_key(other), jid)
+    pipe.zadd(status_key(status), {jid: score})
     
-def _save_job(jid, job_dict):
-    """Save a job object in the Redis database."""
-    jdb.set(jid, json.dumps(job_dict))
+def _save_job(jid, job_dict, pipe=None):
+    """Save a job object in the Redis database and index it (queued on `pipe` if given)."""
+    target = pipe if pipe is not None else jdb.pipeline(transaction=True)
+    target.hset(jid, mapping=_encode_job(job_dict))
+    submitted_at = job_dict.get('submitted_at', time.time())
+    target.zadd(JOB_INDEX_KEY, {jid: submitted_at})
+    _index_status(target, jid, job_dict['status'], job_dict.get('finished_at', submitted_at))
+    if job_dict.get('status') in FINISHED_STATUSES:
+        target.expire(jid, JOB_TTL_SECONDS)
+    if pipe is None:
+        target.execute()
     return
     
-def _queue_job(jid):
-    """Add a job to the redis queue."""
-    q.put(jid)
+class QueueFull(Exception):
+    """The queue holds JOB_MAX_QUEUE_DEPTH jobs; submissions are refused until workers catch up."""
+
+    def __init__(self, message, retry_after=JOB_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+    
+def job_lane(job_type, lane=None):
+    """
+    Return the queue lane of a job: the lane asked for, else its job type's lane.
+    
+    Raises:
+        ValueError: `lane` is not one of JOB_LANES.
+    """
+    if lane is None:
+        lane = JOB_TYPE_LANES.get(job_type, JOB_DEFAULT_LANE)
+    if lane not in JOB_LANES:
+        raise ValueError(f"Unknown lane {lane}. Please use one of: {', '.join(JOB_LANES)}.")
+    return lane
+    
+def _queue_job(jid, pipe=None, lane=JOB_DEFAULT_LANE):
+    """Add a job to the redis queue of `lane` (queued on `pipe` if given)."""
+    queue = queues[lane]
+    if pipe is None:
+        queue.put(jid)
+    else:
+        # the same message queue.put() would push
+        pipe.rpush(queue.key, queue.serializer.dumps(jid))
     return
     
-def add_job(job_type, params, status="submitted"):
-    """Add a job to the redis queue."""
-    jid = _generate_jid()
-    job_dict = _instantiate_job(jid, status, job_type, params)
-    _save_job(jid, job_dict)
-    _queue_job(jid)
-    return job_dict
+def requeue_jobs(job_dicts):
+    """
+    Put jobs a worker took but did not start back at the front of their lanes, in order,
+    so a draining or crashing worker never strands them.
+    """
+    pipe = jdb.pipeline(transaction=False)
+    for job_dict in reversed(job_dicts):
+        queue = queues.get(job_dict.get('lane'), q)
+        pipe.lpush(queue.key, queue.serializer.dumps(job_dict['id']))
+    pipe.execute()
     
-def get_job_by_id(jid):
-    """Return job dictionary given jid"""
-    return json.loads(jdb.get(jid))
+def queue_depths():
+    """Return the number of queued jobs in each lane."""
+    pipe = jdb.pipeline(transaction=False)
+    for queue in queues.values():
+        pipe.llen(queue.key)
+    return dict(zip(queues, pipe.execute()))
+    
+def _admit(count):
+    """
+    Refuse `count` new jobs when they would take the queue beyond JOB_MAX_QUEUE_DEPTH.
+    
+    The check is not atomic with the submission, so concurrent API processes may overshoot
+    the limit by the size of their batches.
+    
+    Raises:
+        QueueFull: The queue is saturated.
+    """
+    if not JOB_MAX_QUEUE_DEPTH:
+        return
+    depth = sum(queue_depths().values())
+    if depth + count > JOB_MAX_QUEUE_DEPTH:
+        raise QueueFull(f"The job queue is full ({depth} of {JOB_MAX_QUEUE_DEPTH} jobs queued); "
+                        f"please retry later.")
+    
+def _normalize_params(job_type, params):
+    """Reduce params to what the renderer actually uses, so equivalent jobs fingerprint alike."""
+    params = params if isinstance(params, dict) else {}
+    if job_type == 'histogram':
+        return {'param': params.get('param')}
+    if job_type == 'line':
+        return {}
+    return params
+    
+def job_fingerprint(job_type, params, version):
+    """Content address of a job's result: its type, normalized params and dataset version."""
+    raw = json.dumps([job_type, _normalize_params(job_type, params), version], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+def image_key(jid):
+    """Key (in the results db) of the rendered image of job `jid`: a plain string, readable in ranges."""
+    return f'image:{jid}'
+    
+# SET (in the results db) of the fingerprints that have jobs waiting on another job's render
+WAITING_KEY = 'fingerprint:waiting'
+    
+def _fingerprint_keys(fingerprint):
+    """Keys (in the results db) of the finished job, the job rendering, and the jobs waiting for it."""
+    return (f'fingerprint:{fingerprint}:result',
+            f'fingerprint:{fingerprint}:inflight',
+            f'fingerprint:{fingerprint}:followers')
+    
+def _claim_fingerprints(claims):
+    """
+    Decide atomically, for a batch of new jobs, how each one gets its result.
+    
+    Jobs of the batch with the same fingerprint follow the first of them, which leads.
+    
+    Args:
+        claims (list): (fingerprint, jid) of each new job.
+    
+    Returns:
+        list: Per job, ('done', jid of a finished identical job), ('follow', jid of the identical
+        job being rendered; the job is now on its followers list) or ('lead', jid: render it).
+    """
+    keys = [_fingerprint_keys(fingerprint) for fingerprint, _ in claims]
+    watched = {key for result_key, inflight_key, _ in keys for key in (result_key, inflight_key)}
+    
+    def claim(pipe):
+        done = pipe.mget([result_key for result_key, _, _ in keys])
+        leaders = pipe.mget([inflight_key for _, inflight_key, _ in keys])
+        # a finished job only counts while its image is still stored
+        stored = {source: pipe.exists(image_key(source))
+                  for source in {value.decode('utf-8') for value in done if value is not None}}
+        pipe.multi()
+        outcomes = []
+        leading = {}
+        for (fingerprint, jid), (_, inflight_key, followers_key), source, leader in zip(claims, keys, done, leaders):
+            if source is not None and stored[source.decode('utf-8')]:
+                outcomes.append(('done', source.decode('utf-8')))
+                continue
+            leader = leading.get(fingerprint) or (leader.decode('utf-8') if leader is not None else None)
+            if leader is not None:
+                pipe.rpush(followers_key, jid)
+                pipe.sadd(WAITING_KEY, fingerprint)
+                outcomes.append(('follow', leader))
+                continue
+            pipe.set(inflight_key, jid, ex=JOB_INFLIGHT_TTL)
+            leading[fingerprint] = jid
+            outcomes.append(('lead', jid))
+        return outcomes
+    
+    return res.transaction(claim, *watched, value_from_callable=True)
+    
+def settle_fingerprint(fingerprint, jid, status):
+    """
+    Publish the outcome of the render of `jid` to the identical jobs waiting for it.
+    
+    The followers are only handed over while `jid` still leads the fingerprint; once a follower
+    has been promoted in its place (see recover_followers), they wait for that one instead.
+    
+    Args:
+        fingerprint (str): The job's fingerprint.
+        jid (str): The job that was rendered.
+        status (str): Its final status ('completed' or 'failed'); followers get the same.
+    """
+    result_key, inflight_key, followers_key = _fingerprint_keys(fingerprint)
+    
+    def settle(pipe):
+        leader = pipe.get(inflight_key)
+        # a lapsed inflight key nobody took over still leaves the followers to `jid`
+        leading = leader is None or leader.decode('utf-8') == jid
+        followers = pipe.lrange(followers_key, 0, -1) if leading else []
+        pipe.multi()
+        if status == 'completed':
+            pipe.set(result_key, jid, ex=JOB_TTL_SECONDS)
+        if leading:
+            pipe.delete(inflight_key, followers_key)
+            pipe.srem(WAITING_KEY, fingerprint)
+        return followers
+    
+    followers = res.transaction(settle, inflight_key, followers_key, value_from_callable=True)
+    if followers:
+        # a follower may not be saved yet; its record then starts from these fields
+        pipe = jdb.pipeline(transaction=True)
+        for follower in followers:
+            _set_status(pipe, follower.decode('utf-8'), status)
+        pipe.execute()
+    
+def _promote_follower(fingerprint, stale_leader):
+    """
+    Replace the leader of `fingerprint` that will never settle with its first follower, and queue it.
     
-def update_job_status(jid, status):
-    """Update the status of job with job id `jid` to status `status`."""
+    Args:
+        fingerprint (str): Fingerprint whose followers are stranded.
+        stale_leader (bytes): The inflight value being replaced (None once it has expired).
+    """
+    _, inflight_key, followers_key = _fingerprint_keys(fingerprint)
+    first = res.lindex(followers_key, 0)
+    if first is None:
+        res.srem(WAITING_KEY, fingerprint)
+        return None
+    job_dict = get_job_by_id(first.decode('utf-8'))
+    if job_dict is None:
+        # not saved yet (or already gone); the next sweep looks again
+        return None
+    
+    def promote(pipe):
+        if pipe.get(inflight_key) != stale_leader or pipe.lindex(followers_key, 0) != first:
+            return None
+        others = pipe.lrange(followers_key, 1, -1)
+        pipe.multi()
+        pipe.lpop(followers_key)
+        pipe.set(inflight_key, first, ex=JOB_INFLIGHT_TTL)
+        return others
+    
+    others = res.transaction(promote, inflight_key, followers_key, value_from_callable=True)
+    if others is None:
+        return None
+    pipe = jdb.pipeline(transaction=True)
+    pipe.hdel(job_dict['id'], 'result_of')
+    # the other followers now get their result from the promoted job
+    for follower in others:
+        pipe.hset(follower.decode('utf-8'), 'result_of', job_dict['id'])
+    _queue_job(job_dict['id'], pipe, job_dict.get('lane', JOB_DEFAULT_LANE))
+    pipe.execute()
+    logging.warning(f"Job {job_dict['id']} now renders fingerprint {fingerprint}; its leader will never settle it")
+    return job_dict['id']
+    
+def recover_followers():
+    """
+    Rescue the jobs waiting on an identical job's render that will never finish.
+    
+    A leader that finished but whose worker died before settle_fingerprint() has its result
+    passed on now; for a leader that is gone (or whose inflight key expired) the first follower
+    is queued to render in its place, and the other followers wait for it.
+    
+    Returns:
+        int: Number of fingerprints recovered.
+    """
+    recovered = 0
+    for fingerprint in res.smembers(WAITING_KEY):
+        fingerprint = fingerprint.decode('utf-8')
+        _, inflight_key, _ = _fingerprint_keys(fingerprint)
+        leader = res.get(inflight_key)
+        if leader is not None:
+            leader_dict = get_job_by_id(leader.decode('utf-8'))
+            if leader_dict is not None and leader_dict['status'] in ('completed', 'failed'):
+                settle_fingerprint(fingerprint, leader_dict['id'], leader_dict['status'])
+                recovered += 1
+                continue
+            if leader_dict is not None and leader_dict['status'] in ('submitted', 'in progress'):
+                # still queued or rendering; its inflight key expires if it never finishes
+                continue
+        if _promote_follower(fingerprint, leader) is not None:
+            recovered += 1
+    return recovered
+    
+def add_jobs(specs, status="submitted"):
+    """
+    Add a batch of jobs to the redis queue; all records are saved and queued in one round trip.
+    
+    A job identical to one already rendered for the current dataset version completes
+    immediately with that job's result ('result_of'); one identical to a job still being
+    rendered (or to an earlier job of the batch) waits for it instead of being queued.
+    
+    Args:
+        specs (list): (job_type, params, lane) of each job; a lane of None picks the job type's lane.
+        status (str): Status of the jobs that are queued.
+    
+    Returns:
+        list: The job dictionaries, in the order of `specs`.
+    
+    Raises:
+        ValueError: A spec names an unknown lane.
+        QueueFull: The jobs would take the queue beyond JOB_MAX_QUEUE_DEPTH; none was added.
+    """
+    # identical jobs only share a result within one dataset version
+    version = dataset_version()
+    jobs = []
+    for job_type, params, lane in specs:
+        job_dict = _instantiate_job(_generate_jid(), status, job_type, params, version)
+        job_dict['lane'] = job_lane(job_type, lane)
+        job_dict['submitted_at'] = round(time.time(), 3)
+        jobs.append(job_dict)
+    if not jobs:
+        return jobs
+    _admit(len(jobs))
+    outcomes = [('lead', job_dict['id']) for job_dict in jobs]
+    if JOB_DEDUP:
+        for job_dict in jobs:
+            job_dict['fingerprint'] = job_fingerprint(job_dict['job_type'], job_dict['params'], version)
+        outcomes = _claim_fingerprints([(job_dict['fingerprint'], job_dict['id']) for job_dict in jobs])
+        for job_dict, (outcome, source) in zip(jobs, outcomes):
+            if outcome != 'lead':
+                job_dict['result_of'] = source
+    followers = [job_dict['id'] for job_dict, (outcome, _) in zip(jobs, outcomes) if outcome == 'follow']
+    
+    def create(pipe):
+        # a leader may already have settled a follower; keep the status it was given
+        settled = {jid for jid in followers if pipe.hexists(jid, 'status')}
+        pipe.multi()
+        for job_dict, (outcome, _) in zip(jobs, outcomes):
+            jid = job_dict['id']
+            if jid in settled:
+                pipe.hset(jid, mapping={name: value for name, value in _encode_job(job_dict).items()
+                                        if name != 'status'})
+                pipe.zadd(JOB_INDEX_KEY, {jid: job_dict['submitted_at']})
+                continue
+            if outcome == 'done':
+                job_dict['status'] = 'completed'
+                job_dict['finished_at'] = job_dict['submitted_at']
+            _save_job(jid, job_dict, pipe)
+            if outcome == 'lead':
+                _queue_job(jid, pipe, job_dict['lane'])
+    
+    jdb.transaction(create, *followers)
+    return jobs
+    
+def add_job(job_type, params, status="submitted", lane=None):
+    """Add a job to the redis queue of `lane` (see add_jobs)."""
+    return add_jobs([(job_type, params, lane)], status)[0]
+    
+def result_job_id(jid):
+    """Return the id of the job whose stored image is the result of job `jid` (None for an unknown job)."""
     job_dict = get_job_by_id(jid)
-    if job_dict:
-        job_dict['status'] = status
-        _save_job(jid, job_dict)
-    else:
-        raise Exception()
+    if job_dict is None:
+        return None
+    return job_dict.get('result_of', jid)
+    
+def get_job_by_id(jid):
+    """Return job dictionary given jid, or None if there is no such job (or its record expired)"""
+    return _decode_job(jdb.hgetall(jid))
+    
+def get_jobs_by_ids(jids):
+    """Return the job dictionaries for a list of jids in one round trip (None for unknown jids)."""
+    if not jids:
+        return []
+    pipe = jdb.pipeline(transaction=False)
+    for jid in jids:
+        pipe.hgetall(jid)
+    return [_decode_job(raw) for raw in pipe.execute()]
+    
+def _set_status(pipe, jid, status, **fields):
+    """Queue the HSET of a job's status, its timestamps and any other `fields`."""
+    now = round(time.time(), 3)
+    fields.update(status=status, updated_at=now)
+    if status == 'in progress':
+        fields['started_at'] = now
+    elif status in FINISHED_STATUSES:
+        fields['finished_at'] = now
+    pipe.hset(jid, mapping=_encode_job(fields))
+    _index_status(pipe, jid, status, now)
+    if status in FINISHED_STATUSES:
+        pipe.expire(jid, JOB_TTL_SECONDS)
+    pipe.publish(events_channel(jid), json.dumps({'id': jid, 'status': status, 'updated_at': now}))
+    
+def update_job_status(jid, status, **fields):
+    """
+    Update the status of job with job id `jid` to status `status`, atomically and only if the job exists.
+    
+    Args:
+        jid (str): Job id.
+        status (str): New status; 'in progress' and the finished statuses also stamp started_at/finished_at.
+        **fields: Other fields to set at the same time (e.g. progress).
+    """
+    def update(pipe):
+        # nothing is written, indexed or published for an unknown (or expired) job
+        if not pipe.exists(jid):
+            raise Exception(f"Job {jid} not found")
+        pipe.multi()
+        _set_status(pipe, jid, status, **fields)
+    
+    jdb.transaction(update, jid)
+    
+def watch_job(jid, timeout, heartbeat=None):
+    """
+    Follow the status of job `jid` as the worker publishes its changes, without polling.
+    
+    Args:
+        jid (str): Job id.
+        timeout (float): Seconds to follow the job for.
+        heartbeat (float): If given, yield None whenever this many seconds pass without a change.
+    
+    Yields:
+        dict: The job as it is now, then again after every status change, until it is finished,
+        gone, or `timeout` passes.
+    """
+    pubsub = jdb.pubsub(ignore_subscribe_messages=True)
+    # subscribe before reading the job, so no change can slip in between
+    pubsub.subscribe(events_channel(jid))
+    try:
+        job_dict = get_job_by_id(jid)
+        yield job_dict
+        deadline = time.monotonic() + timeout
+        while job_dict is not None and job_dict.get('status') not in FINISHED_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            message = pubsub.get_message(timeout=min(remaining, heartbeat or remaining))
+            if message is None:
+                if heartbeat:
+                    yield None
+                continue
+            job_dict = get_job_by_id(jid)
+            yield job_dict
+    finally:
+        pubsub.close()
+    
+def _forget_jobs(jids):
+    """Remove job records and their index entries."""
+    pipe = jdb.pipeline(transaction=False)
+    pipe.delete(*jids)
+    pipe.zrem(JOB_INDEX_KEY, *jids)
+    for status in STATUSES:
+        pipe.zrem(status_key(status), *jids)
+    pipe.execute()
+    
+def _prune_index():
+    """Drop the index entries of finished jobs whose records have expired."""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    pipe = jdb.pipeline(transaction=False)
+    for status in FINISHED_STATUSES:
+        pipe.zrangebyscore(status_key(status), '-inf', cutoff)
+    expired = [jid for jids in pipe.execute() for jid in jids]
+    if expired:
+        _forget_jobs(expired)
+    
+def job_counts():
+    """Return the number of jobs in each status, and in total, with one pipelined ZCARD each."""
+    pipe = jdb.pipeline(transaction=False)
+    for status in STATUSES:
+        pipe.zcard(status_key(status))
+    pipe.zcard(JOB_INDEX_KEY)
+    counts = pipe.execute()
+    return {'total': counts[-1], **dict(zip(STATUSES, counts))}
+    
+def record_queue_waits(job_dicts, now=None):
+    """Count the jobs a worker started from each lane and the seconds they spent queued (until 'started_at')."""
+    now = now or time.time()
+    pipe = jdb.pipeline(transaction=False)
+    for job_dict in job_dicts:
+        lane = job_dict.get('lane', JOB_DEFAULT_LANE)
+        started = job_dict.get('started_at', now)
+        pipe.hincrby(QUEUE_STATS_KEY, f'{lane}:taken', 1)
+        pipe.hincrbyfloat(QUEUE_STATS_KEY, f'{lane}:wait_seconds',
+                          max(0.0, started - job_dict.get('submitted_at', started)))
+    pipe.execute()
+    
+def queue_stats():
+    """
+    Return the depth of each lane, how long its oldest queued job has waited, and the number
+    and mean queued time of the jobs taken off it so far.
+    """
+    now = time.time()
+    pipe = jdb.pipeline(transaction=False)
+    for queue in queues.values():
+        pipe.llen(queue.key)
+        pipe.lindex(queue.key, 0)
+    pipe.hgetall(QUEUE_STATS_KEY)
+    *heads, counters = pipe.execute()
+    counters = {name.decode('utf-8'): float(value) for name, value in counters.items()}
+    oldest = {lane: queue.serializer.loads(head)
+              for (lane, queue), head in zip(queues.items(), heads[1::2]) if head is not None}
+    pipe = jdb.pipeline(transaction=False)
+    for jid in oldest.values():
+        pipe.hget(jid, 'submitted_at')
+    submitted = dict(zip(oldest, pipe.execute()))
+    
+    lanes = {}
+    for (lane, weight), depth in zip(JOB_LANES.items(), heads[0::2]):
+        taken = int(counters.get(f'{lane}:taken', 0))
+        waited = counters.get(f'{lane}:wait_seconds', 0.0)
+        lanes[lane] = {'weight': weight,
+                       'depth': depth,
+                       'oldest_wait_seconds': round(now - float(submitted[lane]), 3) if submitted.get(lane) else 0.0,
+                       'taken': taken,
+                       'mean_wait_seconds': round(waited / taken, 3) if taken else None}
+    return {'depth': sum(lane['depth'] for lane in lanes.values()),
+            'max_depth': JOB_MAX_QUEUE_DEPTH or None,
+            'lanes': lanes}
+    
+def list_jobs(status=None, since=None, limit=100, position=None):
+    """
+    Return one page of jobs from the index.
+    
+    Jobs are listed oldest first: by submit time, or with `status`, by the time they entered it.
+    
+    Args:
+        status (str): Only jobs currently in this status.
+        since (float): Only jobs submitted (or, with `status`, moved to it) after this Unix time.
+        limit (int): Most jobs to return.
+        position (tuple): (score, skip) where the previous page ended: the page continues
+            after the first `skip` jobs with exactly that score.
+    
+    Returns:
+        dict: {'jobs': [job dicts], 'next': (score, skip) to pass as `position`, or None at the end}
+    """
+    _prune_index()
+    key = status_key(status) if status else JOB_INDEX_KEY
+    score, skip = position or (since if since is not None else '-inf', 0)
+    if position is None and since is not None:
+        score = f'({since}'
+    page = jdb.zrangebyscore(key, score, '+inf', start=skip, num=limit + 1, withscores=True)
+    more = len(page) > limit
+    page = page[:limit]
+    jids = [jid.decode('utf-8') for jid, _ in page]
+    found = get_jobs_by_ids(jids)
+    missing = [jid for jid, job_dict in zip(jids, found) if job_dict is None]
+    if missing:
+        _forget_jobs(missing)
+    
+    next_position = None
+    if more and page:
+        last = page[-1][1]
+        # jobs sharing the last score: resume after them, counting those of earlier pages
+        same = sum(1 for _, value in page if value == last)
+        next_position = (last, same + (skip if score == last else 0))
+    return {'jobs': [job_dict for job_dict in found if job_dict is not None],
+            'next': next_position}
     
 def return_all_jobids():
-    keys = jdb.keys()
+    keys = jdb.zrange(JOB_INDEX_KEY, 0, -1)
     keys = [key.decode('utf-8') for key in keys]
     json_keys = json.dumps(keys)
     return json_keys
-    
-
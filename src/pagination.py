@@ -0,0 +1,59 @@
+import json
+import base64
+import binascii
+
+# Page size used when a client pages with a cursor but gives no limit
+DEFAULT_PAGE_SIZE = 1000
+
+
+class CursorError(ValueError):
+    """Raised for a cursor token that is malformed or was issued for a different query."""
+
+
+class CursorExpired(CursorError):
+    """Raised for a cursor whose dataset version has been reloaded and reclaimed since it was issued."""
+
+
+def encode_cursor(kind, query, **position):
+    """
+    Build an opaque cursor token.
+
+    Args:
+        kind (str): Which listing the cursor belongs to (e.g. 'order').
+        query (str): The route parameters the listing was made for.
+        **position: Where the next page starts (namespace, last id, rank, offset...).
+
+    Returns:
+        str: URL-safe token.
+    """
+    state = {'kind': kind, 'query': query, **position}
+    raw = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, kind, query, position=None):
+    """
+    Decode a cursor token made by encode_cursor() for the same `kind` and `query`.
+
+    Args:
+        position (dict): Type (or tuple of types) of each position field the listing reads;
+            include type(None) for a field that may be missing.
+
+    Returns:
+        dict: The position stored in the token.
+
+    Raises:
+        CursorError: If the token is malformed, belongs to another listing or lacks a position field.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        state = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise CursorError("Invalid cursor")
+    if not isinstance(state, dict) or state.get('kind') != kind or state.get('query') != query:
+        raise CursorError("Cursor does not belong to this query")
+    for name, types in (position or {}).items():
+        # bool is an int to isinstance, but never a position
+        if not isinstance(state.get(name), types) or isinstance(state.get(name), bool):
+            raise CursorError("Invalid cursor")
+    return state
@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import redis
+from jobs import get_job_by_id, update_job_status, image_key
+
+# Read the value of the LOG_LEVEL environment variable
+log_level = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=log_level)
+
+REDIS_IP = os.environ.get('REDIS_IP')
+
+# Seconds a rendered image is kept after it is stored
+RESULT_TTL_SECONDS = int(os.environ.get('RESULT_TTL_SECONDS', 24 * 3600))
+# Total bytes of stored images; the least recently used are evicted beyond it
+RESULT_MAX_BYTES = int(os.environ.get('RESULT_MAX_BYTES', 256 * 1024 * 1024))
+# Bytes read from redis per GETRANGE when streaming an image to a client
+RESULT_CHUNK_SIZE = int(os.environ.get('RESULT_CHUNK_SIZE', 256 * 1024))
+
+# Bookkeeping in the results db, next to the images (one string per job, see jobs.image_key)
+LRU_KEY = 'results:lru'          # ZSET job id -> time the image was stored or last read
+EXPIRES_KEY = 'results:expires'  # ZSET job id -> time the image expires
+SIZES_KEY = 'results:sizes'      # HASH job id -> image bytes
+BYTES_KEY = 'results:bytes'      # total image bytes
+STATS_KEY = 'results:stats'      # HASH of eviction/expiry counters
+
+res = redis.Redis(host=REDIS_IP, port=6379, db=3)
+
+
+def store_result(jid, img):
+    """
+    Store the rendered image of job `jid`, then make room for it within RESULT_MAX_BYTES.
+
+    Args:
+        jid (str): Job id.
+        img (bytes): The PNG image.
+    """
+    now = time.time()
+    previous = int(res.hget(SIZES_KEY, jid) or 0)
+    pipe = res.pipeline(transaction=True)
+    pipe.set(image_key(jid), img, ex=RESULT_TTL_SECONDS)
+    pipe.zadd(LRU_KEY, {jid: now})
+    pipe.zadd(EXPIRES_KEY, {jid: now + RESULT_TTL_SECONDS})
+    pipe.hset(SIZES_KEY, jid, len(img))
+    pipe.incrby(BYTES_KEY, len(img) - previous)
+    pipe.execute()
+    sweep_expired(now)
+    enforce_budget()
+
+
+def result_size(jid):
+    """Return the size in bytes of the stored image of job `jid` (None if there is none) and mark it used."""
+    pipe = res.pipeline(transaction=False)
+    pipe.strlen(image_key(jid))
+    pipe.zadd(LRU_KEY, {jid: time.time()}, xx=True)
+    size = pipe.execute()[0]
+    return size or None
+
+
+def iter_result(jid, start, stop, chunk_size=RESULT_CHUNK_SIZE):
+    """
+    Stream bytes [start, stop) of the stored image of job `jid` with GETRANGE, one chunk at a time.
+
+    Yields:
+        bytes: Consecutive chunks; stops early if the image is evicted mid-stream.
+    """
+    while start < stop:
+        chunk = res.getrange(image_key(jid), start, min(start + chunk_size, stop) - 1)
+        if not chunk:
+            return
+        yield chunk
+        start += len(chunk)
+
+
+def mark_expired(jid):
+    """Report a completed job whose image is gone as 'expired'."""
+    job_dict = get_job_by_id(jid)
+    if job_dict is not None and job_dict['status'] == 'completed':
+        update_job_status(jid, 'expired')
+
+
+def _forget(jids, reason):
+    """
+    Drop the images of `jids` and their bookkeeping, counting them under `reason`.
+
+    A job id is only handled by the process whose ZREM removes it, so concurrent
+    workers never account for the same image twice.
+    """
+    jids = [jid.decode('utf-8') if isinstance(jid, bytes) else jid for jid in jids]
+    pipe = res.pipeline(transaction=False)
+    for jid in jids:
+        pipe.zrem(EXPIRES_KEY, jid)
+    claimed = [jid for jid, removed in zip(jids, pipe.execute()) if removed]
+    if not claimed:
+        return
+    sizes = res.hmget(SIZES_KEY, claimed)
+    freed = sum(int(size or 0) for size in sizes)
+    pipe = res.pipeline(transaction=True)
+    pipe.unlink(*[image_key(jid) for jid in claimed])
+    pipe.zrem(LRU_KEY, *claimed)
+    pipe.hdel(SIZES_KEY, *claimed)
+    pipe.decrby(BYTES_KEY, freed)
+    pipe.hincrby(STATS_KEY, reason, len(claimed))
+    pipe.hincrby(STATS_KEY, f'{reason}_bytes', freed)
+    pipe.execute()
+    for jid in claimed:
+        mark_expired(jid)
+
+
+def sweep_expired(now=None):
+    """Account for the images whose TTL has passed (redis already dropped or is dropping them)."""
+    expired = res.zrangebyscore(EXPIRES_KEY, '-inf', now or time.time())
+    if expired:
+        _forget(expired, 'expirations')
+
+
+def enforce_budget():
+    """Evict the least recently used images until the stored total fits RESULT_MAX_BYTES."""
+    while int(res.get(BYTES_KEY) or 0) > RESULT_MAX_BYTES:
+        popped = res.zpopmin(LRU_KEY)
+        if not popped:
+            break
+        jid = popped[0][0]
+        logging.info(f"Evicting the image of job {jid.decode('utf-8')} to stay within RESULT_MAX_BYTES")
+        _forget([jid], 'evictions')
+
+
+def results_stats():
+    """Return the stored image count and bytes, the budget, and the eviction/expiry counters."""
+    pipe = res.pipeline(transaction=False)
+    pipe.zcard(LRU_KEY)
+    pipe.get(BYTES_KEY)
+    pipe.hgetall(STATS_KEY)
+    stored, stored_bytes, counters = pipe.execute()
+    stats = {'evictions': 0, 'evictions_bytes': 0, 'expirations': 0, 'expirations_bytes': 0}
+    stats.update({name.decode('utf-8'): int(value) for name, value in counters.items()})
+    return {'images': stored,
+            'bytes': int(stored_bytes or 0),
+            'max_bytes': RESULT_MAX_BYTES,
+            'ttl_seconds': RESULT_TTL_SECONDS,
+            **stats}
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Read the value of the LOG_LEVEL environment variable
+log_level = os.getenv("LOG_LEVEL", "INFO")
+
+logging.basicConfig(level=log_level)
+
+# Retries for failed connections and 429/5xx answers, with exponential backoff between them
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 5))
+UPSTREAM_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', 0.5))
+# Seconds to wait for a connection and then for each read from the upstream
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 10))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 120))
+# Directory of the on-disk page cache; empty disables it
+UPSTREAM_CACHE_DIR = os.environ.get('UPSTREAM_CACHE_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'crime_api_upstream'))
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _make_session():
+    retry = Retry(total=UPSTREAM_RETRIES, backoff_factor=UPSTREAM_BACKOFF,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'],
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    new_session = requests.Session()
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    new_session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return new_session
+
+
+# One pooled session per process: every page reuses the same keep-alive connections
+session = _make_session()
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'downloaded': 0, 'not_modified': 0, 'bytes_downloaded': 0}
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+
+def _cache_paths(source_url, params):
+    """Return the (body, metadata) file paths caching the page for this url and parameters."""
+    raw = json.dumps([source_url, sorted((params or {}).items())], default=str)
+    name = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    return os.path.join(UPSTREAM_CACHE_DIR, name + '.json'), os.path.join(UPSTREAM_CACHE_DIR, name + '.meta')
+
+
+def _read_validators(body_path, meta_path):
+    """Return the ETag/Last-Modified the cached page was served with, or None if nothing is cached."""
+    try:
+        with open(meta_path) as f:
+            validators = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return validators if os.path.exists(body_path) else None
+
+
+def _read_file(path, chunk_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def fetch_chunks(source_url, params=None, cache=True, chunk_size=_CHUNK_SIZE):
+    """
+    GET an upstream resource through the pooled session, yielding its body as it streams in.
+
+    Pages served with an ETag or Last-Modified are kept in the on-disk cache and revalidated
+    with If-None-Match/If-Modified-Since on the next fetch; a 304 replays the cached copy,
+    so unchanged pages are never downloaded twice. A page is only cached once the generator
+    has been read to the end: one closed early leaves nothing behind.
+
+    Args:
+        source_url (str): Resource url.
+        params (dict): Query parameters.
+        cache (bool): Use the on-disk page cache (off for one-off queries such as incremental filters).
+        chunk_size (int): Bytes per yielded chunk.
+
+    Yields:
+        bytes: The (decompressed) response body, chunk by chunk.
+
+    Raises:
+        requests.RequestException: The upstream could not be reached or answered with an error.
+    """
+    body_path = meta_path = validators = None
+    headers = {}
+    if cache and UPSTREAM_CACHE_DIR:
+        body_path, meta_path = _cache_paths(source_url, params)
+        validators = _read_validators(body_path, meta_path)
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+    _count(requests=1)
+    with session.get(source_url, params=params, headers=headers, stream=True,
+                     timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)) as response:
+        if response.status_code == 304 and validators:
+            _count(not_modified=1)
+            logging.debug(f"Upstream page unchanged, replaying {body_path}")
+            response.close()
+            yield from _read_file(body_path, chunk_size)
+            return
+        response.raise_for_status()
+        _count(downloaded=1)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if body_path is None or not (etag or last_modified):
+            for chunk in response.iter_content(chunk_size):
+                _count(bytes_downloaded=len(chunk))
+                yield chunk
+            return
+
+        # write to a private file and only publish it once the whole body has arrived
+        os.makedirs(UPSTREAM_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    _count(bytes_downloaded=len(chunk))
+                    f.write(chunk)
+                    yield chunk
+            # drop the old validators first so they can never describe the new body
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            os.replace(tmp_path, body_path)
+            with open(tmp_path, 'w') as f:
+                json.dump({'etag': etag, 'last_modified': last_modified, 'url': response.url}, f)
+            os.replace(tmp_path, meta_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def upstream_stats():
+    """Return counters of upstream requests, full downloads, 304 revalidations and bytes downloaded."""
+    with _stats_lock:
+        return {'cache_dir': UPSTREAM_CACHE_DIR or None, **_stats}
@@ -6,9 +6,19 @@ import os
 import logging
 import requests
 from flask import Flask, request, jsonify
-from jobs import return_all_jobids, get_job_by_id, update_job_status, q, rd, jdb
+from jobs import (return_all_jobids, get_job_by_id, get_jobs_by_ids, update_job_status, settle_fingerprint,
+                  record_queue_waits, requeue_jobs, recover_followers, queues, q, rd, jdb, JOB_LANES)
+from dataset import snapshot, top_values, timeseries, dataset_version
+from results import store_result
+import heapq
+import itertools
+from collections import Counter
 import time
-import matplotlib.pyplot as plt
+import signal
+import multiprocessing
+from io import BytesIO
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import pandas as pd
 
 
@@ -31,6 +41,17 @@ res = redis.Redis(host=REDIS_IP, port=6379, db = 3)
 
 url = 'https://data.austintexas.gov/resource/fdj4-gpfu.json'
 
+# Rendering processes per container; defaults to the CPUs the container may use
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 0))
+# Seconds a worker blocks waiting for a job before checking whether it should stop
+WORKER_POLL_SECONDS = int(os.environ.get('WORKER_POLL_SECONDS', 1))
+# Most queued jobs a worker takes at once; jobs of one batch share a parsed copy of the dataset
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', 8))
+# Seconds the supervisor waits for busy workers to finish their job on shutdown
+WORKER_DRAIN_SECONDS = float(os.environ.get('WORKER_DRAIN_SECONDS', 25))
+# Seconds between sweeps for identical jobs left waiting on a render that will never finish
+WORKER_RECOVER_SECONDS = float(os.environ.get('WORKER_RECOVER_SECONDS', 60))
+
 
 def all_values_for(param, data):
     dict_of_values = {}
@@ -49,85 +70,159 @@ def all_values_for(param, data):
 
 
 def top_5_values(data_dict):
-    # Sorting dictionary items based on values (occurrences) in descending order
-    sorted_data = sorted(data_dict.items(), key=lambda x: x[1], reverse=True)
-    
-    # Selecting the top 5 items
-    top_5 = sorted_data[:5]
+    # Selecting the 5 items with the most occurrences, without sorting the whole dictionary
+    top_5 = heapq.nlargest(5, data_dict.items(), key=lambda x: x[1])
     
     # Creating a new dictionary with the top 5 items
     top_5_dict = dict(top_5)
 
     return top_5_dict
 
-def hist_plotter(param):
-    
-    data = []
-    for item in rd.keys():
-        data.append(json.loads(rd.get(item)))
+# The dataset as a DataFrame, parsed once per dataset version and shared by every job rendered from it
+_frame = {'version': None, 'df': None, 'years': None}
 
-    dict_of_values = all_values_for(param, data)
-    
-    top_5_dict = top_5_values(dict_of_values)
+
+def dataset_frame():
+    """Return the dataset as a DataFrame, rebuilt only when the dataset version changes."""
+    version = dataset_version()
+    if _frame['df'] is None or _frame['version'] != version:
+        start = time.perf_counter()
+        df = pd.DataFrame(snapshot())
+        _frame.update(version=version, df=df, years=None)
+        logging.info(f"Parsed dataset version {version} ({len(df)} records) in {time.perf_counter() - start:.2f}s")
+    return _frame['df']
+
+
+def occ_years(df):
+    """Return the year of each record's occ_date, parsed once per dataset frame."""
+    if _frame['df'] is df and _frame['years'] is not None:
+        return _frame['years']
+    years = pd.to_datetime(df['occ_date']).dt.year.rename('year')
+    if _frame['df'] is df:
+        _frame['years'] = years
+    return years
+
+
+def frame_top_values(df, param, k=5):
+    """Return the `k` most common string values of column `param` and their counts."""
+    if param not in df.columns:
+        return {}
+    values = df[param]
+    values = values[values.map(lambda value: isinstance(value, str))]
+    return {value: int(count) for value, count in values.value_counts().nlargest(k).items()}
+
+
+def render_png(fig):
+    """
+    Render a figure to PNG bytes in memory and release it.
+
+    Args:
+        fig (Figure): A figure made with matplotlib.figure.Figure (not registered with pyplot).
+
+    Returns:
+        bytes: The PNG image.
+    """
+    try:
+        buf = BytesIO()
+        FigureCanvasAgg(fig).print_png(buf)
+        return buf.getvalue()
+    finally:
+        fig.clear()
+
+
+def hist_plotter(param, df=None):
+    """
+    Plot a histogram of the 5 most common values of `param`.
+
+    Args:
+        param (str): The field to plot.
+        df (DataFrame): The dataset, for fields without a counter; defaults to dataset_frame().
+
+    Returns:
+        bytes: The plot as a PNG image.
+    """
+    # counted fields keep an ordered counter in redis; anything else is counted from the dataset
+    top_5_dict = top_values(param, 5)
+    if top_5_dict is None:
+        top_5_dict = frame_top_values(df if df is not None else dataset_frame(), param)
     
     # Extracting keys (variables) and values (occurrences) from the dictionary
     variables = list(top_5_dict.keys())
     occurrences = list(top_5_dict.values())
     
-    plt.clf()
+    # A new figure per job: no pyplot state is shared between jobs
+    fig = Figure()
+    ax = fig.subplots()
     
     # Plotting the histogram
-    plt.bar(variables, occurrences, color='skyblue', edgecolor='black')
+    ax.bar(variables, occurrences, color='skyblue', edgecolor='black')
     
     # Adding labels and title
-    plt.xlabel(f"Top 5 values for {param}")
-    plt.ylabel('Occurrences')
-    plt.title(f"Histogram for {param}")
+    ax.set_xlabel(f"Top 5 values for {param}")
+    ax.set_ylabel('Occurrences')
+    ax.set_title(f"Histogram for {param}")
     
     # Rotating x-axis labels for better readability (optional)
-    plt.xticks(rotation=45)
-    plt.xticks(fontsize=8)
-    plt.tight_layout()
+    ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+    fig.tight_layout()
     
-    # Save the plot
-    plt.savefig('/output_image.png')
-
-def line_plotter():
-    # Fetch data from the redis db
-    data = []
-    for item in rd.keys():
-        data.append(json.loads(rd.get(item)))
-    # Load data into a DataFrame
-    df = pd.DataFrame(data)
-    # Convert date columns to datetime objects
-    df['occ_date'] = pd.to_datetime(df['occ_date'])
-    # Extract year from occ_date
-    df['year'] = df['occ_date'].dt.year
-    # Count occurrences of each crime type per year
-    crime_counts = df.groupby(['year', 'crime_type']).size().unstack(fill_value=0)
-    # Get top 5 crime types by total occurrences
-    top_crime_types = crime_counts.sum().nlargest(5).index
+    return render_png(fig)
+
+def frame_timeseries(df, field, k=5):
+    """
+    Count the records of the `k` most common values of column `field` per occ_date year.
+
+    Returns:
+        dict: {'periods': [year, ...], 'series': {value: [count per year]}}, like dataset.timeseries().
+    """
+    # Extract year from occ_date (parsed once per dataset version)
+    years = occ_years(df)
+    # Count occurrences of each value per year
+    counts = df.groupby([years, df[field]]).size().unstack(fill_value=0)
+    # Get top k values by total occurrences
+    top = counts.sum().nlargest(k).index
+    return {'periods': [str(int(year)) for year in counts.index],
+            'series': {value: [int(count) for count in counts[value]] for value in top}}
+
+
+def line_plotter(df=None):
+    """
+    Plot the yearly number of crimes of the 5 most common crime types.
+
+    Args:
+        df (DataFrame): The dataset, for namespaces without time-series rollups; defaults to
+            dataset_frame(). It is not modified.
+
+    Returns:
+        bytes: The plot as a PNG image.
+    """
+    # the yearly counts are kept up to date at ingest time; older namespaces are counted from the dataset
+    crime_counts = timeseries('crime_type', 'year', 5) if df is None else None
+    if crime_counts is None:
+        crime_counts = frame_timeseries(df if df is not None else dataset_frame(), 'crime_type')
+    years = crime_counts['periods']
     # Plot line graph for top 5 crime types
-    plt.figure(figsize=(10, 6))
-    for crime_type in top_crime_types:
-        plt.plot(crime_counts.index, crime_counts[crime_type], label=crime_type)
-    plt.title('Number of Crimes for Top 5 Crime Types Over the Years')
-    plt.xlabel('Year')
-    plt.ylabel('Number of Crimes')
-    plt.legend()
-    plt.grid(True)
-    plt.xticks(crime_counts.index, rotation=45)
-    plt.tight_layout()
-    plt.savefig('/output_image.png')
-
-@q.worker
-def worker(jobid):
-    update_job_status(jobid, 'in progress')    
-    try:
-        job_data = get_job_by_id(jobid)
-    except ValueError:
-        logging.error("This jobid is no longer in the queue")
-    
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    for crime_type, counts in crime_counts['series'].items():
+        ax.plot(years, counts, label=crime_type)
+    ax.set_title('Number of Crimes for Top 5 Crime Types Over the Years')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Number of Crimes')
+    ax.legend()
+    ax.grid(True)
+    ax.set_xticks(years)
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    return render_png(fig)
+
+def render_job(job_data):
+    """
+    Render the image of one job.
+
+    Returns:
+        bytes: The PNG image, or None for an unknown job type.
+    """
     job_type = job_data.get('job_type')
     
     if job_type == "histogram":
@@ -137,17 +232,214 @@ def worker(jobid):
         except NameError:
             logging.error("Parameter not found in job_data")
 
-        hist_plotter(param)
+        return hist_plotter(param)
     
     elif job_type == "line":
-        line_plotter()
+        return line_plotter()
+
+    logging.error(f"Unknown job type {job_type} for job {job_data.get('id')}")
+    return None
+
+
+def process_jobs(jobids, stop=None):
+    """
+    Render a batch of jobs, those of the heavier-weighted lanes first.
+
+    Every job is drawn from the dataset current when it runs; dataset_frame() parses it
+    once per version, so the jobs of a batch share one parsed copy.
+
+    Args:
+        jobids (list): Job ids taken off the queue.
+        stop (Event): Checked before each job; once set, the jobs not started yet are put back
+            at the front of their lanes instead of being rendered.
+    """
+    pending = []
+    for jobid, job_data in zip(jobids, get_jobs_by_ids(jobids)):
+        if job_data is None:
+            logging.error(f"Job {jobid} is no longer in the jobs database")
+            continue
+        pending.append(job_data)
+    pending.sort(key=lambda job_data: -JOB_LANES.get(job_data.get('lane'), 0))
+    started = []
+    job_data = None
+    try:
+        while pending:
+            if stop is not None and stop.is_set():
+                logging.info(f"Stopping; putting {len(pending)} jobs back on the queue")
+                break
+            job_data = pending.pop(0)
+            jobid = job_data['id']
+            job_data['started_at'] = time.time()
+            update_job_status(jobid, 'in progress')
+            try:
+                img = render_job(job_data)
+                if img is not None:
+                    # the image goes straight from memory to the results db
+                    store_result(jobid, img)
+            except Exception:
+                logging.exception(f"Job {jobid} failed")
+                img = None
+            status = 'failed' if img is None else 'completed'
+            update_job_status(jobid, status)
+            # identical jobs submitted while this one was rendering share its result
+            if job_data.get('fingerprint'):
+                settle_fingerprint(job_data['fingerprint'], jobid, status)
+            started.append(job_data)
+            job_data = None
+    except BaseException:
+        # the job that was interrupted is rendered again from scratch by the next worker
+        if job_data is not None:
+            pending.insert(0, job_data)
+        raise
+    finally:
+        # also on the way out of a crash: jobs taken but never started go back on the queue
+        if pending:
+            requeue_jobs(pending)
+        if started:
+            record_queue_waits(started)
+
+
+def lane_schedule(weights):
+    """
+    Interleave the lanes in proportion to their weights (smooth weighted round robin).
+
+    Args:
+        weights (dict): Lane -> weight, e.g. {'high': 4, 'normal': 2, 'low': 1}.
+
+    Returns:
+        list: One cycle of lanes, e.g. ['high', 'normal', 'high', 'low', 'high', 'normal', 'high'].
+    """
+    total = sum(weights.values())
+    current = dict.fromkeys(weights, 0)
+    schedule = []
+    for _ in range(total):
+        for lane, weight in weights.items():
+            current[lane] += weight
+        lane = max(current, key=current.get)
+        current[lane] -= total
+        schedule.append(lane)
+    return schedule
+
+
+# Each worker process walks the schedule on its own; together they drain the lanes by weight
+_schedule = itertools.cycle(lane_schedule(JOB_LANES))
+# Lanes to fall back on, heaviest first, when the scheduled lane is empty
+_fallback = sorted(JOB_LANES, key=JOB_LANES.get, reverse=True)
+
+
+def next_jobs():
+    """
+    Wait up to WORKER_POLL_SECONDS for a job, then take whatever else is queued, up to WORKER_BATCH_SIZE.
+
+    Lanes are taken in their weighted order; an empty lane passes its turn to the heaviest
+    lane that has jobs, so no worker idles while any job is queued.
+
+    Returns:
+        list: Job ids; empty when every lane stayed empty.
+    """
+    lane = next(_schedule)
+    keys = [queues[lane].key] + [queues[other].key for other in _fallback if other != lane]
+    popped = jdb.blpop(keys, timeout=WORKER_POLL_SECONDS)
+    if popped is None:
+        return []
+    jobids = [q.serializer.loads(popped[1])]
+    if WORKER_BATCH_SIZE > 1:
+        # fill the rest of the batch by weight in one round trip
+        turns = Counter(next(_schedule) for _ in range(WORKER_BATCH_SIZE - 1))
+        pipe = jdb.pipeline(transaction=False)
+        for lane, count in turns.items():
+            pipe.lpop(queues[lane].key, count)
+        for messages in pipe.execute():
+            jobids.extend(q.serializer.loads(message) for message in messages or [])
+    return jobids
+
+
+def worker(stop=None):
+    """
+    Take batches of jobs off the queue and process them until `stop` is set.
+
+    Args:
+        stop (Event): Set to drain: the job in progress is finished, the rest of its batch is
+            put back on the queue and no new job is taken.
+    """
+    stop = stop or multiprocessing.Event()
+    last_recovery = 0.0
+    while not stop.is_set():
+        if time.monotonic() - last_recovery >= WORKER_RECOVER_SECONDS:
+            last_recovery = time.monotonic()
+            recovered = recover_followers()
+            if recovered:
+                logging.warning(f"Recovered {recovered} groups of identical jobs whose leader died")
+        jobids = next_jobs()
+        if jobids:
+            process_jobs(jobids, stop)
+
+
+def available_cpus():
+    """Return the number of CPUs this container may use (its cgroup CPU limit, if any)."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def _run_worker(stop):
+    # shutdown goes through the supervisor, which sets `stop` so the job in progress is finished
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker(stop)
+
+
+def start_workers(num_processes, stop):
+    """Start `num_processes` worker processes that drain once `stop` is set."""
+    processes = []
+    for n in range(num_processes):
+        process = multiprocessing.Process(target=_run_worker, args=(stop,), name=f'worker-{n}', daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
 
-    with open('/output_image.png', 'rb') as f:
-        img = f.read()
-    res.hset(jobid, 'image', img)
-    update_job_status(jobid, 'completed')
+def supervise(num_processes=None):
+    """
+    Run `num_processes` worker processes, replacing any that die, until SIGTERM/SIGINT;
+    then let every worker finish its current job (up to WORKER_DRAIN_SECONDS) and exit.
+    """
+    num_processes = num_processes or WORKER_PROCESSES or available_cpus()
+    stop = multiprocessing.Event()
+    # the handlers only flip a flag: setting the Event from a signal handler can deadlock
+    # against the main thread
+    signalled = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: signalled.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: signalled.append(signum))
+    processes = start_workers(num_processes, stop)
+    logging.info(f"Started {num_processes} worker processes")
 
+    while not signalled:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error(f"{process.name} exited with code {process.exitcode}; restarting it")
+                processes[i] = multiprocessing.Process(target=_run_worker, args=(stop,),
+                                                       name=process.name, daemon=True)
+                processes[i].start()
 
-worker()
+    logging.info("Draining worker processes")
+    stop.set()
+    deadline = time.monotonic() + WORKER_DRAIN_SECONDS
+    for process in processes:
+        process.join(max(0, deadline - time.monotonic()))
+    for process in processes:
+        if process.is_alive():
+            logging.warning(f"{process.name} did not finish its job in time; terminating it")
+            process.kill()
 
 
+if __name__ == '__main__':
+    supervise()
@@ -0,0 +1,43 @@
+import sys
+import pytest
+import redis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Point the redis clients and job queues of the loaded src modules at one in-memory fakeredis server.
+
+    Returns:
+        dict: db number -> the fakeredis client standing in for that db.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    clients = {}
+
+    def fake(client):
+        db = client.connection_pool.connection_kwargs.get('db', 0)
+        if db not in clients:
+            clients[db] = fakeredis.FakeRedis(server=server, db=db)
+        return clients[db]
+
+    for name in ('dataset', 'cache', 'jobs', 'results', 'worker', 'api'):
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        for attr, value in list(vars(module).items()):
+            if isinstance(value, redis.Redis):
+                monkeypatch.setattr(module, attr, fake(value))
+    if 'jobs' in sys.modules:
+        for queue in sys.modules['jobs'].queues.values():
+            monkeypatch.setattr(queue, '_HotQueue__redis', fake(queue._HotQueue__redis))
+    if 'dataset' in sys.modules:
+        # per-process caches of what the previous test's server held
+        dataset = sys.modules['dataset']
+        monkeypatch.setattr(dataset, '_meta_cache', {})
+        monkeypatch.setattr(dataset, '_snapshot', {'version': None, 'records': None, 'bytes': 0})
+    if 'cache' in sys.modules:
+        cache = sys.modules['cache']
+        monkeypatch.setattr(cache, 'response_cache',
+                            cache.ResponseCache(cache.RESPONSE_CACHE_ENTRIES, cache.RESPONSE_CACHE_MAX_BYTES))
+    return clients
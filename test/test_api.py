@@ -1,7 +1,14 @@
 import os
+import json
+import time
+import threading
 import requests
 import pytest
-from api import hello_world
+import api
+import dataset
+import jobs
+from jobs import update_job_status
+from api import app, hello_world
 
 # Obtain the Flask application's IP address from environment variable
 
@@ -45,6 +52,14 @@ def test_data_endpoint(client):
     response_delete = client.delete('/data')
     assert response_delete.status_code == 200
 
+def test_load_data_page_size(client):
+    assert client.post('/data?page_size=-5').status_code == 400
+    assert client.post('/data?page_size=0').status_code == 400
+
+def test_load_data_batch_size(client):
+    assert client.post('/data?batch_size=-5').status_code == 400
+    assert client.post('/data?batch_size=0').status_code == 400
+
 def test_all_values_for(client):
     response = client.get('/all_values_for/crime_type')
     assert response.status_code == 200
@@ -66,37 +81,221 @@ def test_order(client):
     assert 'data' in response.json
     assert 'message' in response.json
 
-def test_jobs_general(client):
+def test_jobs_general(client, fake_redis):
     # Test POST request
     data = {'job_type': 'histogram', 'params': {'param': 'crime_type'}}
     response_post = client.post('/jobs', json=data)
     assert response_post.status_code == 200
     assert isinstance(response_post.json, dict)
-    assert 'job_id' in response_post.json
+    assert 'id' in response_post.json
 
     # Test GET request
     response_get = client.get('/jobs')
     assert response_get.status_code == 200
-    assert isinstance(response_get.json, list)
+    assert [job['id'] for job in response_get.json['jobs']] == [response_post.json['id']]
+    assert response_get.json['counts']['submitted'] == 1
+    assert response_get.json['cursor'] is None
 
-def test_get_job(client):
-    # Get job id from previous test
+def test_get_job(client, fake_redis):
+    client.post('/jobs', json={'job_type': 'line', 'params': {}})
     response_get_jobs = client.get('/jobs')
     assert response_get_jobs.status_code == 200
-    assert isinstance(response_get_jobs.json, list)
-    job_id = response_get_jobs.json[0]['job_id']
+    job_id = response_get_jobs.json['jobs'][0]['id']
 
     response = client.get(f'/jobs/{job_id}')
     assert response.status_code == 200
     assert isinstance(response.json, dict)
-    assert 'job_id' in response.json
+    assert response.json['id'] == job_id
+
+def _submit(client, count, job_type='line'):
+    return [client.post('/jobs', json={'job_type': job_type, 'params': {}}).json['id'] for _ in range(count)]
+
+def _list_all(client, query):
+    ids, url = [], f'/jobs?{query}'
+    while url is not None:
+        page = client.get(url).json
+        ids.extend(job['id'] for job in page['jobs'])
+        url = page['next']
+    return ids
+
+@pytest.fixture
+def listed_jobs(client, fake_redis, monkeypatch):
+    # identical jobs would wait on the first one; list them all as separate jobs
+    monkeypatch.setattr(jobs, 'JOB_DEDUP', False)
+    return client
+
+def test_list_jobs_limit(listed_jobs):
+    assert listed_jobs.get('/jobs?limit=0').status_code == 400
+    assert listed_jobs.get('/jobs?limit=-3').status_code == 400
+
+def test_list_jobs_status_filter(listed_jobs):
+    first, second, third = _submit(listed_jobs, 3)
+    update_job_status(second, 'completed')
+    assert _list_all(listed_jobs, 'status=completed') == [second]
+    assert _list_all(listed_jobs, 'status=submitted') == [first, third]
+    assert listed_jobs.get('/jobs?status=done').status_code == 400
+
+def test_list_jobs_since(listed_jobs, monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1000.0)
+    early = _submit(listed_jobs, 2)
+    monkeypatch.setattr(time, 'time', lambda: 2000.0)
+    late = _submit(listed_jobs, 2)
+    # jobs submitted at the same time are listed in id order
+    assert _list_all(listed_jobs, 'since=1500') == sorted(late)
+    assert _list_all(listed_jobs, 'since=0&limit=1') == sorted(early) + sorted(late)
+
+def test_list_jobs_cursor_continuity(listed_jobs, monkeypatch):
+    # every job shares one submit time, so pages end inside a run of equal scores
+    monkeypatch.setattr(time, 'time', lambda: 1000.0)
+    submitted = _submit(listed_jobs, 5)
+    first = listed_jobs.get('/jobs?limit=2').json
+    assert len(first['jobs']) == 2
+    # jobs submitted later are picked up by the same walk, and none is listed twice
+    monkeypatch.setattr(time, 'time', lambda: 2000.0)
+    submitted += _submit(listed_jobs, 1)
+    listed = [job['id'] for job in first['jobs']] + _list_all(listed_jobs, f"limit=2&cursor={first['cursor']}")
+    assert sorted(listed) == sorted(submitted)
+    assert len(listed) == len(set(listed))
+    # a cursor belongs to the filter it was issued for
+    assert listed_jobs.get(f"/jobs?status=completed&cursor={first['cursor']}").status_code == 400
+
+def test_list_jobs_prunes_expired_entries(listed_jobs):
+    finished, vanished, kept = _submit(listed_jobs, 3)
+    update_job_status(finished, 'completed')
+    # the record of a finished job outlived its TTL; another record vanished outright
+    jobs.jdb.delete(finished, vanished)
+    jobs.jdb.zadd(jobs.status_key('completed'), {finished: time.time() - jobs.JOB_TTL_SECONDS - 1})
+    page = listed_jobs.get('/jobs').json
+    assert [job['id'] for job in page['jobs']] == [kept]
+    assert page['counts']['completed'] == 0
+    assert jobs.jdb.zrange(jobs.JOB_INDEX_KEY, 0, -1) == [kept.encode()]
+
+def test_post_job_validation(client, fake_redis):
+    response = client.post('/jobs', json={'job_type': 'scatter', 'params': {}})
+    assert response.status_code == 400
+    assert response.json['errors'] == ["'job_type' must be one of: histogram, line"]
+    response = client.post('/jobs', json={'job_type': 'line'})
+    assert response.status_code == 400
+    assert response.json['errors'] == ["'params' must be an object"]
+    assert client.post('/jobs', json={'job_type': 'line', 'params': {}, 'priority': 'urgent'}).status_code == 400
+    assert client.post('/jobs', data='not json').status_code == 400
+    assert client.get('/jobs').json['counts']['total'] == 0
+
+def test_post_job_batch(listed_jobs):
+    specs = [{'job_type': 'line', 'params': {}},
+             {'job_type': 'histogram', 'params': {'param': 'district'}, 'priority': 'low'},
+             {'job_type': 'histogram', 'params': {'param': 'crime_type'}}]
+    response = listed_jobs.post('/jobs/batch', json=specs)
+    assert response.status_code == 200
+    ids = response.json['ids']
+    assert [job['id'] for job in response.json['jobs']] == ids
+    # ids come back in the order the jobs were submitted
+    assert [listed_jobs.get(f'/jobs/{jid}').json['params'] for jid in ids] == [spec['params'] for spec in specs]
+    assert listed_jobs.get(f'/jobs/{ids[1]}').json['lane'] == 'low'
+
+def test_post_job_batch_is_all_or_nothing(listed_jobs):
+    specs = [{'job_type': 'line', 'params': {}},
+             {'job_type': 'scatter', 'params': []},
+             'histogram']
+    response = listed_jobs.post('/jobs/batch', json={'jobs': specs})
+    assert response.status_code == 400
+    assert response.json['errors'] == ["jobs[1]: 'job_type' must be one of: histogram, line",
+                                       "jobs[1]: 'params' must be an object",
+                                       "jobs[2]: expected an object with 'job_type' and 'params'"]
+    assert listed_jobs.get('/jobs').json['counts']['total'] == 0
+
+def test_post_job_batch_max(listed_jobs, monkeypatch):
+    monkeypatch.setattr(api, 'JOB_BATCH_MAX', 2)
+    assert listed_jobs.post('/jobs/batch', json=[{'job_type': 'line', 'params': {}}] * 3).status_code == 400
+    assert listed_jobs.post('/jobs/batch', json=[]).status_code == 400
+    assert listed_jobs.get('/jobs').json['counts']['total'] == 0
+    assert listed_jobs.post('/jobs/batch', json=[{'job_type': 'line', 'params': {}}] * 2).status_code == 200
+
+def _events(chunks):
+    for chunk in chunks:
+        chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('event: status'):
+            yield json.loads(chunk.split('data: ', 1)[1])['status']
+
+def test_wait_for_job_returns_on_completion(listed_jobs):
+    jid = _submit(listed_jobs, 1)[0]
+
+    def finish():
+        time.sleep(0.2)
+        update_job_status(jid, 'in progress')
+        update_job_status(jid, 'completed')
+    threading.Thread(target=finish).start()
+    start = time.monotonic()
+    response = listed_jobs.get(f'/jobs/{jid}/wait?timeout=10')
+    assert response.json['status'] == 'completed'
+    assert time.monotonic() - start < 5
+
+def test_wait_for_job_times_out(listed_jobs):
+    jid = _submit(listed_jobs, 1)[0]
+    start = time.monotonic()
+    response = listed_jobs.get(f'/jobs/{jid}/wait?timeout=0.3')
+    assert response.status_code == 200
+    assert response.json['status'] == 'submitted'
+    assert 0.3 <= time.monotonic() - start < 5
+    assert listed_jobs.get('/jobs/missing/wait?timeout=0.3').status_code == 404
+
+def test_job_events_stream(listed_jobs, monkeypatch):
+    monkeypatch.setattr(api, 'JOB_EVENTS_HEARTBEAT_SECONDS', 0.05)
+    jid = _submit(listed_jobs, 1)[0]
+    response = listed_jobs.get(f'/jobs/{jid}/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    events = _events(chunks)
+    # the current state comes first, then each change as it is published
+    assert next(events) == 'submitted'
+    update_job_status(jid, 'in progress')
+    assert next(events) == 'in progress'
+    update_job_status(jid, 'completed')
+    assert next(events) == 'completed'
+    # the stream ends once the job is finished
+    assert list(events) == []
+    response.close()
+    assert listed_jobs.get('/jobs/missing/events').status_code == 404
+
+RECORDS = [{'incident_report_number': str(2024000 + n), 'crime_type': 'THEFT',
+            'address': 'MAIN ST', 'occ_time': str(100 * n)} for n in range(5)]
+
+@pytest.fixture
+def loaded(client, fake_redis):
+    namespace = dataset.new_namespace()
+    dataset.load_records(RECORDS, namespace)
+    dataset.activate(namespace)
+    return client
+
+# crime_type and occ_time are indexed; address is only found by scanning the snapshot
+PAGED_ROUTES = ['/data', '/all_data_for/crime_type/THEFT', '/all_data_for/address/MAIN%20ST',
+                '/order/ascend/occ_time', '/order/ascend/address']
+
+@pytest.mark.parametrize('route', PAGED_ROUTES)
+def test_paged_routes_reject_limit_below_one(loaded, route):
+    assert loaded.get(f'{route}?limit=0').status_code == 400
+    assert loaded.get(f'{route}?limit=-1').status_code == 400
+
+@pytest.mark.parametrize('route', PAGED_ROUTES[1:])
+def test_paged_routes_end_without_cursor(loaded, route):
+    response = loaded.get(f'{route}?limit=2&offset=10')
+    assert response.status_code == 200
+    assert response.json['cursor'] is None and response.json['next'] is None
+    # following the cursors visits every record exactly once
+    seen, url = [], f'{route}?limit=2'
+    while url is not None:
+        page = loaded.get(url).json
+        records = page.get('all data', page.get('data'))
+        assert records
+        seen.extend(record['incident_report_number'] for record in records)
+        url = page['next']
+    assert sorted(seen) == [record['incident_report_number'] for record in RECORDS]
 
 def test_calculate_result(client):
     # Get job id from previous test
     response_get_jobs = client.get('/jobs')
     assert response_get_jobs.status_code == 200
-    assert isinstance(response_get_jobs.json, list)
-    job_id = response_get_jobs.json[0]['job_id']
+    job_id = response_get_jobs.json['jobs'][0]['id']
 
     response = client.get(f'/results/{job_id}')
     assert response.status_code == 200
@@ -105,9 +304,52 @@ def test_download(client):
     # Get job id from previous test
     response_get_jobs = client.get('/jobs')
     assert response_get_jobs.status_code == 200
-    assert isinstance(response_get_jobs.json, list)
-    job_id = response_get_jobs.json[0]['job_id']
+    job_id = response_get_jobs.json['jobs'][0]['id']
 
     response = client.get(f'/download/{job_id}')
     assert response.status_code == 200
     assert response.headers['Content-Type'] == 'image/png'
+
+
+IMAGE = bytes(range(100))
+
+
+@pytest.fixture
+def stored_image(monkeypatch):
+    monkeypatch.setattr(api, 'result_job_id', lambda jid: 'src')
+    monkeypatch.setattr(api, 'result_size', lambda jid: len(IMAGE))
+    monkeypatch.setattr(api, 'iter_result', lambda jid, start, stop: iter([IMAGE[start:stop]]))
+
+
+def test_result_full_image(client, stored_image):
+    response = client.get('/results/abc')
+    assert response.status_code == 200
+    assert response.data == IMAGE
+    assert response.headers['ETag'] == '"src"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+def test_result_not_modified(client, stored_image):
+    response = client.get('/results/abc', headers={'If-None-Match': '"src"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_result_range(client, stored_image):
+    response = client.get('/download/abc', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == IMAGE[10:20]
+    assert response.headers['Content-Range'] == 'bytes 10-19/100'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=abc.png'
+
+def test_result_range_not_satisfiable(client, stored_image):
+    response = client.get('/results/abc', headers={'Range': 'bytes=200-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */100'
+
+def test_result_if_range(client, stored_image):
+    # the range is only honoured while the client's copy is the same image
+    response = client.get('/results/abc', headers={'Range': 'bytes=0-9', 'If-Range': '"src"'})
+    assert response.status_code == 206
+    assert response.data == IMAGE[:10]
+    response = client.get('/results/abc', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == IMAGE
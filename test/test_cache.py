@@ -0,0 +1,36 @@
+from cache import ResponseCache, cache_key
+
+
+def _entry(body):
+    return {'etag': 'x', 'body': body, 'mimetype': 'application/json'}
+
+
+def test_cache_key_ignores_argument_order():
+    assert cache_key('h', '/order/ascend/occ_date', [('limit', '5'), ('offset', '10')], 3) == \
+        cache_key('h', '/order/ascend/occ_date', [('offset', '10'), ('limit', '5')], 3)
+    assert cache_key('h', '/order/ascend/occ_date', [], 3) != cache_key('h', '/order/ascend/occ_date', [], 4)
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2, max_bytes=100)
+    cache.put('a', _entry(b'1'))
+    cache.put('b', _entry(b'2'))
+    assert cache.get('a', 1) is not None
+    cache.put('c', _entry(b'3'))
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) is not None
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2 and stats['misses'] == 1
+
+
+def test_byte_budget_and_new_version():
+    cache = ResponseCache(max_entries=10, max_bytes=10)
+    cache.get('a', 1)
+    cache.put('a', _entry(b'123456'))
+    cache.put('b', _entry(b'123456'))
+    cache.put('big', _entry(b'x' * 11))
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['uncacheable'] == 1
+    assert cache.get('b', 2) is None
+    assert cache.stats()['invalidations'] == 1
@@ -0,0 +1,24 @@
+import pytest
+from codec import get_codec, train_dictionary
+
+RECORD = {'incident_report_number': '20195030047', 'crime_type': 'THEFT', 'district': 'B', 'occ_time': '1135'}
+
+
+@pytest.mark.parametrize('name', ['json', 'msgpack'])
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    assert codec.decode(codec.encode(RECORD)) == RECORD
+
+
+def test_zstd_codec_with_dictionary():
+    pytest.importorskip('zstandard')
+    samples = [dict(RECORD, incident_report_number=str(20195030000 + i)) for i in range(200)]
+    dictionary = train_dictionary(samples, size=1024)
+    codec = get_codec('msgpack+zstd', dictionary)
+    assert codec.decode(codec.encode(RECORD)) == RECORD
+    assert train_dictionary(samples[:10]) is None
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec('pickle')
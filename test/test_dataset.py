@@ -0,0 +1,134 @@
+import pytest
+from collections import Counter
+import dataset
+from dataset import _update_indexes, _apply_counts, index_key, ids_key, order_key, order_score, timeseries_key
+
+
+@pytest.fixture
+def meta():
+    return {'indexed_fields': ['crime_type', 'district'], 'order_fields': []}
+
+
+def _index(meta, old, new):
+    """Index record 2024001 of namespace 7 going from `old` to `new`; return the counter changes."""
+    pipe = dataset.rd.pipeline()
+    counts = Counter()
+    _update_indexes(pipe, '7', meta, '2024001', old, new, counts)
+    pipe.execute()
+    return counts
+
+
+def _members(key):
+    return [member.decode('utf-8') for member in dataset.rd.zrange(key, 0, -1)]
+
+
+def test_update_indexes_new_record(fake_redis, meta):
+    counts = _index(meta, None, {'crime_type': 'THEFT', 'district': 'B', 'address': 'X'})
+    assert _members(ids_key('7')) == ['2024001']
+    assert _members(index_key('7', 'crime_type', 'THEFT')) == ['2024001']
+    assert _members(index_key('7', 'district', 'B')) == ['2024001']
+    # only the configured fields are indexed
+    assert _members(index_key('7', 'address', 'X')) == []
+    assert counts == {('crime_type', None): 1, ('district', None): 1, ('address', None): 1,
+                      ('crime_type', 'THEFT'): 1, ('district', 'B'): 1}
+
+
+def test_update_indexes_changed_record(fake_redis, meta):
+    old = {'crime_type': 'THEFT', 'district': 'B'}
+    _index(meta, None, old)
+    counts = _index(meta, old, {'crime_type': 'ROBBERY', 'district': 'B'})
+    assert _members(index_key('7', 'crime_type', 'THEFT')) == []
+    assert _members(index_key('7', 'crime_type', 'ROBBERY')) == ['2024001']
+    assert _members(index_key('7', 'district', 'B')) == ['2024001']
+    assert +counts == {('crime_type', 'ROBBERY'): 1}
+    assert -counts == {('crime_type', 'THEFT'): 1}
+
+
+def test_order_score():
+    assert order_score('1970-01-02T00:00:00.000') == 86400.0
+    assert order_score('1970-01-02') == 86400.0
+    assert order_score('1135') == 1135.0
+    assert order_score('-97.7431') == -97.7431
+    assert order_score('RESIDENCE / HOME') is None
+    assert order_score(None) is None
+
+
+def test_update_indexes_order_fields(fake_redis):
+    meta = {'indexed_fields': [], 'order_fields': ['occ_time', 'latitude']}
+    old = {'occ_time': '930', 'latitude': '30.2'}
+    _index(meta, None, old)
+    counts = _index(meta, old, {'occ_time': '1135'})
+    assert dataset.rd.zscore(order_key('7', 'occ_time'), '2024001') == 1135.0
+    assert dataset.rd.zscore(order_key('7', 'latitude'), '2024001') is None
+    assert counts == {('latitude', None): -1}
+
+
+def test_update_indexes_timeseries(fake_redis):
+    meta = {'indexed_fields': [], 'order_fields': [],
+            'timeseries_fields': ['crime_type'], 'timeseries_date_field': 'occ_date'}
+    old = {'crime_type': 'THEFT', 'occ_date': '2023-12-31T00:00:00.000'}
+    new = {'crime_type': 'THEFT', 'occ_date': '2024-01-01T00:00:00.000'}
+    counts = _index(meta, old, new)
+    # the value's total is unchanged; only the periods move
+    assert +counts == {('crime_type', 'THEFT', 'year', '2024'): 1,
+                       ('crime_type', 'THEFT', 'month', '2024-01'): 1,
+                       ('crime_type', 'THEFT', 'day', '2024-01-01'): 1}
+    assert -counts == {('crime_type', 'THEFT', 'year', '2023'): 1,
+                       ('crime_type', 'THEFT', 'month', '2023-12'): 1,
+                       ('crime_type', 'THEFT', 'day', '2023-12-31'): 1}
+
+    pipe = dataset.rd.pipeline()
+    _apply_counts(pipe, '7', Counter({('crime_type', 'THEFT', 'month', '2024-01'): 2}))
+    _apply_counts(pipe, '7', Counter({('crime_type', 'THEFT', 'month', '2024-01'): 1,
+                                      ('crime_type', 'THEFT', 'month', '2023-12'): 0}))
+    pipe.execute()
+    assert dataset.rd.hgetall(timeseries_key('7', 'crime_type', 'month', 'THEFT')) == {b'2024-01': b'3'}
+
+
+def test_iter_record_batches_stops_when_namespace_is_reclaimed(monkeypatch):
+    steps = iter([(5, [{'crime_type': 'THEFT'}]), (0, [])])
+    exists = iter([True, False])
+    monkeypatch.setattr(dataset, 'active_namespace', lambda: '7')
+    monkeypatch.setattr(dataset, 'scan_records', lambda namespace, cursor, count: next(steps))
+    monkeypatch.setattr(dataset, 'namespace_exists', lambda namespace: next(exists))
+    batches = dataset.iter_record_batches()
+    assert next(batches) == [{'crime_type': 'THEFT'}]
+    # the empty last step is not mistaken for the end of the dataset
+    with pytest.raises(dataset.NamespaceReclaimed):
+        next(batches)
+
+
+RECORDS = [{'incident_report_number': str(2024000 + n), 'crime_type': 'THEFT' if n % 2 else 'ROBBERY',
+            'occ_time': str(time)} for n, time in enumerate([1135, 930, 2210, 45, 1600])]
+
+
+@pytest.fixture
+def loaded(fake_redis):
+    namespace = dataset.new_namespace()
+    dataset.load_records(RECORDS, namespace)
+    dataset.activate(namespace)
+    return namespace
+
+
+def _spy(monkeypatch, name, sizes):
+    command = getattr(dataset.rd, name)
+
+    def spy(*args, **kwargs):
+        result = command(*args, **kwargs)
+        sizes.append(len(result))
+        return result
+    monkeypatch.setattr(dataset.rd, name, spy)
+
+
+def test_order_records_without_limit_reads_in_slices(loaded, monkeypatch):
+    monkeypatch.setattr(dataset, 'INGEST_BATCH_SIZE', 2)
+    sizes = []
+    _spy(monkeypatch, 'zrange', sizes)
+    _spy(monkeypatch, 'mget', sizes)
+    ordered = dataset.order_records('occ_time')
+    assert [record['occ_time'] for record in ordered['records']] == ['45', '930', '1135', '1600', '2210']
+    assert ordered['next_offset'] is None
+    # no single command reads more than one slice of the index or the records
+    assert max(sizes) == 2
+    descending = dataset.order_records('occ_time', descending=True, offset=1)
+    assert [record['occ_time'] for record in descending['records']] == ['1600', '1135', '930', '45']
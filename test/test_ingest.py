@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from ingest import iter_json_array, iter_pages, _strip_system_fields, _prefetch
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_SIZE = 2
+
+
+class _PagedHandler(BaseHTTPRequestHandler):
+    """Socrata stand-in: serves fixtures/page_<n>.json for $offset = n * $limit."""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.server.requests_seen.append(query)
+        page = int(query['$offset'][0]) // int(query['$limit'][0])
+        path = os.path.join(FIXTURES, f'page_{page}.json')
+        body = b'[]'
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _PagedHandler)
+    server.requests_seen = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_iter_json_array_split_chunks():
+    document = json.dumps([{'crime_type': 'THEFT'}, {'crime_type': 'ROBBERY', 'note': 'café ]['}]).encode()
+    # one byte at a time splits every token and the multi-byte character
+    chunks = [document[i:i + 1] for i in range(len(document))]
+    assert list(iter_json_array(chunks)) == json.loads(document)
+
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array([b' [ ] '])) == []
+
+
+def test_iter_json_array_truncated():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[{"crime_type": "THEFT"}, {"crime']))
+
+
+def test_iter_pages(upstream):
+    source_url = f'http://127.0.0.1:{upstream.server_port}/resource/fdj4-gpfu.json'
+    pages = list(iter_pages(source_url, PAGE_SIZE))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert pages[2][0]['incident_report_number'] == '20195030047'
+    assert [query['$offset'] for query in upstream.requests_seen] == [['0'], ['2'], ['4']]
+
+
+def test_iter_pages_stops_at_empty_page(upstream):
+    source_url = f'http://127.0.0.1:{upstream.server_port}/resource/fdj4-gpfu.json'
+    # no page is ever shorter than a negative page size; the empty one still ends the listing
+    pages = list(iter_pages(source_url, -5))
+    assert [len(page) for page in pages] == [2]
+    assert len(upstream.requests_seen) == 2
+
+
+def test_iter_pages_incremental_filter(upstream):
+    source_url = f'http://127.0.0.1:{upstream.server_port}/resource/fdj4-gpfu.json'
+    where = ":updated_at > '2024-05-01T00:00:00.000'"
+    list(iter_pages(source_url, PAGE_SIZE, where, ':updated_at, :id'))
+    assert upstream.requests_seen[0]['$where'] == [where]
+    assert upstream.requests_seen[0]['$order'] == [':updated_at, :id']
+
+
+def test_strip_system_fields():
+    marks = {'high_water_mark': None}
+    records = [{':id': 'row-1', ':updated_at': '2024-05-02T10:00:00.000', 'incident_report_number': '1'},
+               {':id': 'row-2', ':updated_at': '2024-05-09T08:30:00.000', 'incident_report_number': '2'},
+               {':id': 'row-3', ':updated_at': '2024-05-03T00:00:00.000', 'incident_report_number': '3'}]
+    stripped = list(_strip_system_fields(records, marks))
+    assert stripped == [{'incident_report_number': '1'},
+                        {'incident_report_number': '2'},
+                        {'incident_report_number': '3'}]
+    assert marks['high_water_mark'] == '2024-05-09T08:30:00.000'
+
+
+def test_prefetch_stops_producer_when_consumer_closes():
+    produced = []
+
+    def pages():
+        for n in range(100):
+            produced.append(n)
+            yield [n]
+
+    existing = set(threading.enumerate())
+    fetched = _prefetch(pages(), 1)
+    assert next(fetched) == [0]
+    producer, = set(threading.enumerate()) - existing
+    fetched.close()
+    # the producer gives up its blocked put instead of waiting for a consumer forever
+    producer.join(timeout=2)
+    assert not producer.is_alive()
+    assert len(produced) < 100
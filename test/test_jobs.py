@@ -1,3 +1,8 @@
+import pytest
+import jobs
+from jobs import (job_fingerprint, job_lane, add_job, get_job_by_id, update_job_status, settle_fingerprint,
+                  status_key, _save_job)
+
 '''
 import pytest
 import json
@@ -98,3 +103,159 @@ def test_return_all_jobids(redis_connection):
     assert jid2 in all_job_ids
 '''
 
+
+def test_job_fingerprint():
+    # only the params a job type uses are part of its fingerprint
+    assert job_fingerprint('histogram', {'param': 'crime_type'}, 3) == \
+        job_fingerprint('histogram', {'param': 'crime_type', 'note': 'dashboard'}, 3)
+    assert job_fingerprint('line', {'param': 'n/a'}, 3) == job_fingerprint('line', {}, 3)
+    assert job_fingerprint('histogram', {'param': 'crime_type'}, 3) != \
+        job_fingerprint('histogram', {'param': 'district'}, 3)
+    assert job_fingerprint('histogram', {'param': 'crime_type'}, 3) != \
+        job_fingerprint('histogram', {'param': 'crime_type'}, 4)
+
+
+def test_job_lane():
+    # by default cheap histograms and heavy line plots are queued in different lanes
+    assert job_lane('histogram') == 'high'
+    assert job_lane('line') == 'low'
+    assert job_lane('line', 'high') == 'high'
+    with pytest.raises(ValueError):
+        job_lane('histogram', 'urgent')
+
+
+def test_update_job_status(fake_redis):
+    jid = add_job('histogram', {'param': 'crime_type'})['id']
+    update_job_status(jid, 'in progress', progress=0.5)
+    job_dict = get_job_by_id(jid)
+    assert job_dict['status'] == 'in progress'
+    assert job_dict['started_at'] is not None
+    assert jobs.jdb.ttl(jid) == -1
+    update_job_status(jid, 'completed')
+    assert get_job_by_id(jid)['status'] == 'completed'
+    # finished jobs expire, and are only indexed under their current status
+    assert 0 < jobs.jdb.ttl(jid) <= jobs.JOB_TTL_SECONDS
+    assert jobs.jdb.zscore(status_key('completed'), jid) is not None
+    assert jobs.jdb.zscore(status_key('in progress'), jid) is None
+
+
+def test_update_job_status_unknown_job(fake_redis):
+    events = jobs.jdb.pubsub()
+    events.subscribe(jobs.events_channel('missing'))
+    events.get_message(timeout=1)
+    with pytest.raises(Exception, match='not found'):
+        update_job_status('missing', 'completed')
+    # nothing is written, indexed or published
+    assert get_job_by_id('missing') is None
+    assert all(jobs.jdb.zscore(status_key(status), 'missing') is None for status in jobs.STATUSES)
+    assert events.get_message(timeout=0.1) is None
+
+
+@pytest.fixture
+def job_index(fake_redis):
+    for jid, score in [('a', 1.0), ('b', 2.0), ('c', 2.0), ('d', 2.0), ('e', 3.0)]:
+        _save_job(jid, {'id': jid, 'status': 'submitted', 'job_type': 'line', 'params': {}, 'submitted_at': score})
+
+
+def _all_pages(limit, since=None):
+    position, pages = None, []
+    while True:
+        page = jobs.list_jobs(since=since, limit=limit, position=position)
+        pages.append([job_dict['id'] for job_dict in page['jobs']])
+        position = page['next']
+        if position is None:
+            return pages
+
+
+def test_list_jobs_pages_through_equal_scores(job_index):
+    # pages that end inside a run of equal scores resume after the jobs already listed
+    assert jobs.list_jobs(limit=2)['next'] == (2.0, 1)
+    assert jobs.list_jobs(limit=2, position=(2.0, 1))['next'] == (2.0, 3)
+    assert _all_pages(2) == [['a', 'b'], ['c', 'd'], ['e']]
+    assert _all_pages(1) == [['a'], ['b'], ['c'], ['d'], ['e']]
+    assert _all_pages(5) == [['a', 'b', 'c', 'd', 'e']]
+
+
+def test_list_jobs_since(job_index):
+    # since is exclusive; later pages resume from their position instead
+    assert _all_pages(1, since=1.0) == [['b'], ['c'], ['d'], ['e']]
+    assert _all_pages(2, since=2.0) == [['e']]
+
+
+def _queued():
+    return [queue.serializer.loads(message)
+            for queue in jobs.queues.values() for message in jobs.jdb.lrange(queue.key, 0, -1)]
+
+
+def _finish(jid, status='completed'):
+    # what the worker does once a render is over
+    if status == 'completed':
+        jobs.res.set(jobs.image_key(jid), b'png')
+    update_job_status(jid, status)
+    settle_fingerprint(get_job_by_id(jid)['fingerprint'], jid, status)
+
+
+def _submit():
+    return add_job('histogram', {'param': 'crime_type'})['id']
+
+
+def test_duplicate_of_rendered_job_completes_at_once(fake_redis):
+    first = _submit()
+    _finish(first)
+    second = add_job('histogram', {'param': 'crime_type'})
+    assert second['status'] == 'completed'
+    assert second['result_of'] == first
+    assert _queued() == [first]
+
+
+def test_duplicate_of_rendering_job_waits_for_it(fake_redis):
+    leader = _submit()
+    follower = _submit()
+    assert get_job_by_id(follower)['status'] == 'submitted'
+    assert get_job_by_id(follower)['result_of'] == leader
+    # only the leader is rendered
+    assert _queued() == [leader]
+    _finish(leader)
+    assert get_job_by_id(follower)['status'] == 'completed'
+    assert jobs.result_job_id(follower) == leader
+
+
+def test_failed_render_fails_its_followers(fake_redis):
+    leader = _submit()
+    follower = _submit()
+    _finish(leader, 'failed')
+    assert get_job_by_id(follower)['status'] == 'failed'
+    # a failure is not reused: the next identical job renders again
+    retry = _submit()
+    assert get_job_by_id(retry).get('result_of') is None
+    assert _queued() == [leader, retry]
+
+
+def test_recover_followers_of_dead_leader(fake_redis):
+    leader = _submit()
+    first, second = _submit(), _submit()
+    # the leader's worker died: nothing settles, and its inflight key lapses
+    assert jobs.recover_followers() == 0
+    jobs.res.delete(jobs._fingerprint_keys(get_job_by_id(leader)['fingerprint'])[1])
+    assert jobs.recover_followers() == 1
+    assert _queued() == [leader, first]
+    assert get_job_by_id(first).get('result_of') is None
+    assert get_job_by_id(second)['result_of'] == first
+    _finish(first)
+    assert get_job_by_id(second)['status'] == 'completed'
+    assert jobs.result_job_id(second) == first
+    assert jobs.recover_followers() == 0
+
+
+def test_stale_leader_leaves_promoted_followers_alone(fake_redis):
+    leader = _submit()
+    first, second = _submit(), _submit()
+    jobs.res.delete(jobs._fingerprint_keys(get_job_by_id(leader)['fingerprint'])[1])
+    jobs.recover_followers()
+    # the old leader turns out to finish after all, before the promoted job has rendered
+    _finish(leader)
+    assert get_job_by_id(first)['status'] == 'submitted'
+    assert get_job_by_id(second)['status'] == 'submitted'
+    assert jobs.result_job_id(second) == first
+    _finish(first)
+    assert get_job_by_id(second)['status'] == 'completed'
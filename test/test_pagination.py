@@ -0,0 +1,47 @@
+import pytest
+from pagination import encode_cursor, decode_cursor, CursorError
+
+
+def test_cursor_round_trip():
+    token = encode_cursor('order', 'ascend:occ_date', ns='4', offset=2000)
+    assert '=' not in token
+    state = decode_cursor(token, 'order', 'ascend:occ_date')
+    assert state['ns'] == '4'
+    assert state['offset'] == 2000
+
+
+def test_cursor_for_other_query():
+    token = encode_cursor('all_data_for', 'crime_type=THEFT', ns='4', after='20195030047')
+    with pytest.raises(CursorError):
+        decode_cursor(token, 'all_data_for', 'crime_type=ROBBERY')
+    with pytest.raises(CursorError):
+        decode_cursor(token, 'order', 'crime_type=THEFT')
+
+
+def test_malformed_cursor():
+    with pytest.raises(CursorError):
+        decode_cursor('not a cursor!', 'data', '')
+    with pytest.raises(CursorError):
+        decode_cursor('WzEsMiwzXQ', 'data', '')  # a valid token shape holding a JSON list
+
+
+def test_cursor_position_fields():
+    jobs = {'score': (int, float), 'skip': int}
+    state = decode_cursor(encode_cursor('jobs', 'status=', score=1700000000.5, skip=2), 'jobs', 'status=', jobs)
+    assert (state['score'], state['skip']) == (1700000000.5, 2)
+    # a token for the right listing that lacks (or garbles) its position is still rejected
+    with pytest.raises(CursorError):
+        decode_cursor(encode_cursor('jobs', 'status=', score=1700000000.5), 'jobs', 'status=', jobs)
+    with pytest.raises(CursorError):
+        decode_cursor(encode_cursor('jobs', 'status=', score='x', skip=2), 'jobs', 'status=', jobs)
+    with pytest.raises(CursorError):
+        decode_cursor(encode_cursor('jobs', 'status=', score=1.0, skip=True), 'jobs', 'status=', jobs)
+
+
+def test_cursor_optional_position_fields():
+    position = {'ns': str, 'after': (str, type(None)), 'offset': (int, type(None))}
+    token = encode_cursor('all_data_for', 'crime_type=THEFT', ns='4', offset=1000)
+    assert decode_cursor(token, 'all_data_for', 'crime_type=THEFT', position)['offset'] == 1000
+    token = encode_cursor('all_data_for', 'crime_type=THEFT', ns='4', offset='1000')
+    with pytest.raises(CursorError):
+        decode_cursor(token, 'all_data_for', 'crime_type=THEFT', position)
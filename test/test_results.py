@@ -0,0 +1,84 @@
+import itertools
+import time
+import pytest
+import jobs
+import results
+from jobs import add_job, get_job_by_id, update_job_status
+from results import store_result, result_size, results_stats, image_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # one second per call, so every image has its own place in the LRU order
+    ticks = itertools.count(time.time())
+    monkeypatch.setattr(time, 'time', lambda: float(next(ticks)))
+
+
+def _completed_job():
+    jid = add_job('histogram', {'param': 'crime_type'})['id']
+    update_job_status(jid, 'completed')
+    return jid
+
+
+@pytest.fixture
+def completed(fake_redis, monkeypatch):
+    # every job renders on its own here
+    monkeypatch.setattr(jobs, 'JOB_DEDUP', False)
+    return _completed_job
+
+
+def test_enforce_budget_evicts_least_recently_used(completed, clock, monkeypatch):
+    monkeypatch.setattr(results, 'RESULT_MAX_BYTES', 25)
+    a, b, c, d = (completed() for _ in range(4))
+    store_result(a, b'a' * 10)
+    store_result(b, b'b' * 10)
+    store_result(c, b'c' * 10)
+    # a was stored first and never read
+    assert result_size(a) is None
+    assert get_job_by_id(a)['status'] == 'expired'
+    # reading b makes c the least recently used
+    assert result_size(b) == 10
+    store_result(d, b'd' * 10)
+    assert result_size(c) is None
+    assert [result_size(jid) for jid in (b, d)] == [10, 10]
+    stats = results_stats()
+    assert (stats['images'], stats['bytes']) == (2, 20)
+    assert (stats['evictions'], stats['evictions_bytes']) == (2, 20)
+    assert get_job_by_id(b)['status'] == 'completed'
+
+
+def test_forget_counts_each_image_once(completed):
+    jid = completed()
+    store_result(jid, b'x' * 7)
+    # a second worker racing for the same image finds it already claimed
+    results._forget([jid], 'evictions')
+    results._forget([jid], 'evictions')
+    stats = results_stats()
+    assert (stats['images'], stats['bytes']) == (0, 0)
+    assert (stats['evictions'], stats['evictions_bytes']) == (1, 7)
+    assert not results.res.exists(image_key(jid))
+
+
+def test_sweep_expired(completed):
+    kept, gone = completed(), completed()
+    store_result(kept, b'k' * 3)
+    store_result(gone, b'g' * 5)
+    results.res.zadd(results.EXPIRES_KEY, {gone: time.time() - 1})
+    results.sweep_expired()
+    stats = results_stats()
+    assert (stats['expirations'], stats['expirations_bytes'], stats['bytes']) == (1, 5, 3)
+    assert get_job_by_id(gone)['status'] == 'expired'
+    assert get_job_by_id(kept)['status'] == 'completed'
+
+
+def test_mark_expired_only_moves_completed_jobs(completed):
+    jid = completed()
+    results.mark_expired(jid)
+    assert get_job_by_id(jid)['status'] == 'expired'
+    failed = add_job('line', {})['id']
+    update_job_status(failed, 'failed')
+    results.mark_expired(failed)
+    assert get_job_by_id(failed)['status'] == 'failed'
+    # an unknown job is left alone rather than created
+    results.mark_expired('missing')
+    assert get_job_by_id('missing') is None
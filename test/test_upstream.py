@@ -0,0 +1,68 @@
+import json
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import upstream
+from ingest import iter_pages
+
+RECORDS = [{'incident_report_number': '20195030047', 'crime_type': 'THEFT'}]
+# like Socrata, the body goes on after the array's closing ']'
+BODY = json.dumps(RECORDS).encode() + b'\n'
+
+
+class _ETagHandler(BaseHTTPRequestHandler):
+    """Serves BODY with an ETag, answering 304 to a matching If-None-Match."""
+
+    def do_GET(self):
+        self.server.requests_seen.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(upstream, 'UPSTREAM_CACHE_DIR', str(tmp_path))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ETagHandler)
+    server.requests_seen = []
+    server.etag = '"v1"'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_revalidated_page_is_replayed_from_disk(server):
+    source_url = f'http://127.0.0.1:{server.server_port}/resource.json'
+    before = upstream.upstream_stats()
+    # through the ingest path, whose JSON parser stops reading at the closing ']'
+    assert list(iter_pages(source_url, page_size=2)) == [RECORDS]
+    assert list(iter_pages(source_url, page_size=2)) == [RECORDS]
+    assert server.requests_seen == [None, '"v1"']
+    stats = upstream.upstream_stats()
+    assert stats['downloaded'] - before['downloaded'] == 1
+    assert stats['not_modified'] - before['not_modified'] == 1
+
+    # a changed upstream page is downloaded again
+    server.etag = '"v2"'
+    assert list(iter_pages(source_url, page_size=2)) == [RECORDS]
+    assert list(iter_pages(source_url, page_size=2)) == [RECORDS]
+    assert server.requests_seen[2:] == ['"v1"', '"v2"']
+
+
+def test_uncached_fetch(server):
+    source_url = f'http://127.0.0.1:{server.server_port}/resource.json'
+    assert b''.join(upstream.fetch_chunks(source_url, {'$where': 'x'}, cache=False)) == BODY
+    assert b''.join(upstream.fetch_chunks(source_url, {'$where': 'x'}, cache=False)) == BODY
+    assert server.requests_seen == [None, None]
@@ -1,3 +1,13 @@
+import itertools
+import threading
+from collections import Counter
+import pytest
+import jobs
+import worker
+from worker import lane_schedule
+from jobs import _queue_job, add_jobs, get_job_by_id
+from results import result_size
+
 '''
 import os
 import json
@@ -97,3 +107,123 @@ def test_worker():
             mock_hist_plotter.assert_called_once_with("value")
 '''
 
+
+def test_lane_schedule_follows_weights():
+    schedule = lane_schedule({'high': 4, 'normal': 2, 'low': 1})
+    assert schedule == ['high', 'normal', 'high', 'low', 'high', 'normal', 'high']
+    schedule = lane_schedule({'a': 5, 'b': 3, 'c': 2})
+    assert Counter(schedule) == {'a': 5, 'b': 3, 'c': 2}
+    # the heaviest lane is spread out instead of served in one run
+    assert ('a', 'a', 'a') not in zip(schedule, schedule[1:], schedule[2:])
+
+
+def test_lane_schedule_single_lane():
+    assert lane_schedule({'normal': 3}) == ['normal'] * 3
+
+
+def _fill_lanes(**counts):
+    for lane, count in counts.items():
+        for n in range(count):
+            _queue_job(f'{lane}{n}', lane=lane)
+
+
+def test_next_jobs_takes_lanes_by_weight(fake_redis, monkeypatch):
+    monkeypatch.setattr(worker, 'WORKER_BATCH_SIZE', 4)
+    monkeypatch.setattr(worker, '_schedule', itertools.cycle(['low', 'high', 'high', 'normal']))
+    _fill_lanes(high=3, normal=3, low=3)
+    assert worker.next_jobs() == ['low0', 'high0', 'high1', 'normal0']
+    assert worker.next_jobs() == ['low1', 'high2', 'normal1']
+
+
+def test_next_jobs_falls_back_to_lanes_with_jobs(fake_redis, monkeypatch):
+    monkeypatch.setattr(worker, 'WORKER_BATCH_SIZE', 1)
+    monkeypatch.setattr(worker, '_schedule', itertools.cycle(['high']))
+    _fill_lanes(normal=1, low=1)
+    # the scheduled lane is empty: its turn goes to the heaviest lane holding jobs
+    assert worker.next_jobs() == ['normal0']
+    assert worker.next_jobs() == ['low0']
+
+
+@pytest.fixture
+def batch(fake_redis, monkeypatch):
+    """Jobs taken off their lanes by a worker, in the order given: (job_type, lane) each."""
+    monkeypatch.setattr(jobs, 'JOB_DEDUP', False)
+
+    def take(*specs):
+        jids = [job_dict['id'] for job_dict in add_jobs([(job_type, {'param': 'crime_type'}, lane)
+                                                        for job_type, lane in specs])]
+        for queue in jobs.queues.values():
+            jobs.jdb.delete(queue.key)
+        return jids
+    return take
+
+
+def _render(monkeypatch, outcome):
+    rendered = []
+
+    def render_job(job_data):
+        rendered.append(job_data['id'])
+        return outcome(job_data['id'])
+    monkeypatch.setattr(worker, 'render_job', render_job)
+    return rendered
+
+
+def _queued(lane):
+    queue = jobs.queues[lane]
+    return [queue.serializer.loads(message) for message in jobs.jdb.lrange(queue.key, 0, -1)]
+
+
+def test_process_jobs_heavier_lanes_first(batch, monkeypatch):
+    low, high, normal = batch(('line', 'low'), ('histogram', 'high'), ('histogram', 'normal'))
+    rendered = _render(monkeypatch, lambda jid: b'png')
+    worker.process_jobs([low, high, normal])
+    assert rendered == [high, normal, low]
+    assert [get_job_by_id(jid)['status'] for jid in (low, high, normal)] == ['completed'] * 3
+    assert all(result_size(jid) == 3 for jid in (low, high, normal))
+
+
+def test_process_jobs_failure_leaves_batch_alone(batch, monkeypatch):
+    first, broken, last = batch(('line', 'normal'), ('line', 'normal'), ('line', 'normal'))
+
+    def outcome(jid):
+        if jid == broken:
+            raise ValueError('no such column')
+        return b'png'
+    _render(monkeypatch, outcome)
+    worker.process_jobs([first, broken, last])
+    assert [get_job_by_id(jid)['status'] for jid in (first, broken, last)] == ['completed', 'failed', 'completed']
+    assert result_size(broken) is None
+
+
+def test_process_jobs_requeues_unstarted_on_stop(batch, monkeypatch):
+    first, second, third = batch(('line', 'normal'), ('line', 'normal'), ('line', 'low'))
+    jobs.queues['normal'].put('already queued')
+    stop = threading.Event()
+
+    def outcome(jid):
+        # a SIGTERM arrives while the first job renders
+        stop.set()
+        return b'png'
+    rendered = _render(monkeypatch, outcome)
+    worker.process_jobs([first, second, third], stop)
+    assert rendered == [first]
+    assert get_job_by_id(first)['status'] == 'completed'
+    # the rest go back to the front of their lanes, untouched
+    assert _queued('normal') == [second, 'already queued']
+    assert _queued('low') == [third]
+    assert get_job_by_id(second)['status'] == 'submitted'
+
+
+def test_process_jobs_requeues_on_crash(batch, monkeypatch):
+    first, second, third = batch(('line', 'normal'), ('line', 'normal'), ('line', 'normal'))
+
+    def outcome(jid):
+        if jid == second:
+            raise KeyboardInterrupt
+        return b'png'
+    _render(monkeypatch, outcome)
+    with pytest.raises(KeyboardInterrupt):
+        worker.process_jobs([first, second, third])
+    assert get_job_by_id(first)['status'] == 'completed'
+    # the interrupted job is rendered again from scratch, ahead of the one it was holding up
+    assert _queued('normal') == [second, third]